@@ -1,16 +1,54 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+import io
 import os
+import re
+import csv
+import asyncio
+import json
+import hashlib
+import base64
+import gzip
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime
+import math
+import time
+import random
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, defaultdict, deque
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from pymongo import ReturnDocument, UpdateOne
+from bson import ObjectId
+from bson.int64 import Int64
+from pymongo.errors import (
+    BulkWriteError, ConnectionFailure, DuplicateKeyError, ExecutionTimeout,
+    OperationFailure, PyMongoError, WTimeoutError
+)
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for Parquet exports
+    pa = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -36,6 +74,7 @@ class User(BaseModel):
     level: int = 1
     total_points: int = 0
     streak: int = 0
+    last_active_day: Optional[str] = None  # UTC day of the latest activity, "YYYY-MM-DD"
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -59,6 +98,8 @@ class Lesson(BaseModel):
     difficulty: str
     topics: List[str]
     content: Dict[str, Any]
+    section_bits: Dict[str, int] = Field(default_factory=dict)
+    version: int = 1
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class LessonCreate(BaseModel):
@@ -69,6 +110,14 @@ class LessonCreate(BaseModel):
     topics: List[str]
     content: Dict[str, Any]
 
+class LessonUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    duration: Optional[str] = None
+    difficulty: Optional[str] = None
+    topics: Optional[List[str]] = None
+    content: Optional[Dict[str, Any]] = None
+
 class UserLessonProgress(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -79,6 +128,15 @@ class UserLessonProgress(BaseModel):
     completed_at: Optional[datetime] = None
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class QuizAttempt(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    answers: List[Optional[int]]  # selected option index per question, None if skipped
+    submitted_at: datetime = Field(default_factory=datetime.utcnow)
+
+class QuizAttemptBatch(BaseModel):
+    attempts: List[QuizAttempt]
+
 class ClimateCondition(BaseModel):
     type: str  # "drought", "flood", "heatwave", "cold_snap", "salinity"
     severity: str  # "mild", "moderate", "severe", "extreme"
@@ -197,6 +255,13 @@ class Achievement(BaseModel):
     points: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class AchievementCreate(BaseModel):
+    name: str
+    description: str
+    icon: str
+    criteria: Dict[str, Any]
+    points: int = 0
+
 class UserAchievement(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -229,6 +294,35 @@ class ProjectUpdate(BaseModel):
     content: Optional[Dict[str, Any]] = None
     status: Optional[str] = None
 
+class SyncEvent(BaseModel):
+    event_id: str  # generated by the client, makes replays idempotent
+    type: str  # "lesson_progress", "ethical_decision", "project_edit"
+    timestamp: datetime
+    data: Dict[str, Any]
+
+    @field_validator("timestamp")
+    @classmethod
+    def naive_utc(cls, value: datetime) -> datetime:
+        # Clients send both "...Z" and naive times; stored times are naive UTC
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+class SyncBatch(BaseModel):
+    events: List[SyncEvent]
+
+class SyncLessonProgress(BaseModel):
+    lesson_id: str
+    progress: int
+
+class SyncEthicalDecision(BaseModel):
+    scenario_id: str
+    selected_option: str
+    reasoning: str
+
+class SyncProjectEdit(ProjectUpdate):
+    project_id: str
+
 # Helper function to convert ObjectId to string
 def serialize_doc(doc):
     if doc:
@@ -236,6 +330,346 @@ def serialize_doc(doc):
         return doc
     return None
 
+async def bulk_upsert(collection, updates: List[Any]):
+    """Apply (query, update) pairs as one unordered bulk write of upserts"""
+    if not updates:
+        return None
+    try:
+        return await collection.bulk_write(
+            [UpdateOne(query, update, upsert=True) for query, update in updates],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        # Lost insert races surface as duplicate keys; the rows exist now, so retry as plain updates
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            query, update = updates[error["index"]]
+            await collection.update_one(query, update)
+        return None
+
+# Pre-serialized JSON payloads with strong ETags
+def encode_json(data) -> bytes:
+    return json.dumps(jsonable_encoder(data), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def etag_matches(if_none_match: Optional[str], etags: List[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in if_none_match.split(","))
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+# Bodies smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 512
+
+class CachedPayload:
+    """A JSON body encoded and compressed once, served as-is on every request"""
+    __slots__ = ("body", "etag", "encoded")
+
+    def __init__(self, data):
+        self.body = encode_json(data)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        # content-coding -> (compressed body, strong ETag of that representation)
+        self.encoded: Dict[str, Any] = {}
+        if len(self.body) >= COMPRESSION_MIN_SIZE:
+            if brotli is not None:
+                self.encoded["br"] = (brotli.compress(self.body), f'"{digest}-br"')
+            self.encoded["gzip"] = (gzip.compress(self.body, mtime=0), f'"{digest}-gzip"')
+
+    def etags(self) -> List[str]:
+        return [self.etag] + [etag for _, etag in self.encoded.values()]
+
+def payload_response(request: Request, payload: CachedPayload) -> Response:
+    body, etag, encoding = payload.body, payload.etag, None
+    accepted = accepted_encodings(request.headers.get("accept-encoding"))
+    for candidate in ("br", "gzip"):
+        if candidate in payload.encoded and candidate in accepted:
+            body, etag = payload.encoded[candidate]
+            encoding = candidate
+            break
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), payload.etags()):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Gamification: activity events update points, level and streak in place;
+# achievement unlocks only add points
+ACTIVITY_POINTS = {
+    "lesson_completed": 50,
+    "simulation_completed": 30,
+    "ethical_decision": 20,
+    "project_created": 25
+}
+POINTS_PER_LEVEL = 500
+
+def level_for_points(points: int) -> int:
+    return 1 + points // POINTS_PER_LEVEL
+
+def current_streak(user: Dict[str, Any]) -> int:
+    """The stored streak, or 0 if the user missed a day since it was written"""
+    yesterday = (datetime.utcnow().date() - timedelta(days=1)).isoformat()
+    last_day = user.get("last_active_day")
+    return user.get("streak", 0) if last_day and last_day >= yesterday else 0
+
+async def award_points(user_id: str, points: int) -> Optional[Dict[str, Any]]:
+    """Add points and raise the level with atomic updates; returns the updated user
+
+    Points alone say nothing about when the user was active: achievement
+    unlocks and backfills award points without touching the streak.
+    """
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"total_points": points}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "total_points": 1, "level": 1, "streak": 1, "last_active_day": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return None
+    level = level_for_points(user["total_points"])
+    if level > user.get("level", 1):
+        await db.users.update_one({"id": user_id}, {"$max": {"level": level}})
+    return user
+
+async def record_active_day(user_id: str, user: Dict[str, Any]):
+    """Extend the streak on the user's first activity of the UTC day
+
+    user holds the streak and last_active_day read by award_points.
+    """
+    now = datetime.utcnow()
+    today = now.date().isoformat()
+    last_day = user.get("last_active_day")
+    if last_day == today:
+        return
+    yesterday = (now.date() - timedelta(days=1)).isoformat()
+    streak = user.get("streak", 0) + 1 if last_day == yesterday else 1
+    # Compare-and-set on the day so concurrent events extend the streak once
+    await db.users.update_one(
+        {"id": user_id, "last_active_day": last_day},
+        {"$set": {"streak": streak, "last_active_day": today}}
+    )
+
+# Achievements: criteria map activity counters to thresholds, e.g.
+# {"lessons_completed": 5} or {"lessons_completed": 1, "projects_created": 1}
+ACTIVITY_COUNTERS = {
+    "lesson_completed": "lessons_completed",
+    "simulation_completed": "simulations_completed",
+    "ethical_decision": "ethical_decisions",
+    "project_created": "projects_created"
+}
+
+DEFAULT_ACHIEVEMENTS = [
+    {"id": "first-lesson", "name": "First Steps", "description": "Complete your first lesson", "icon": "📘", "criteria": {"lessons_completed": 1}, "points": 25},
+    {"id": "lesson-scholar", "name": "Scholar", "description": "Complete 5 lessons", "icon": "🎓", "criteria": {"lessons_completed": 5}, "points": 100},
+    {"id": "first-simulation", "name": "Gene Editor", "description": "Complete your first custom simulation", "icon": "🧬", "criteria": {"simulations_completed": 1}, "points": 25},
+    {"id": "simulation-expert", "name": "Simulation Expert", "description": "Complete 10 custom simulations", "icon": "🔬", "criteria": {"simulations_completed": 10}, "points": 150},
+    {"id": "ethical-thinker", "name": "Ethical Thinker", "description": "Make 3 ethical decisions", "icon": "⚖️", "criteria": {"ethical_decisions": 3}, "points": 50},
+    {"id": "first-project", "name": "Creator", "description": "Create your first project", "icon": "📝", "criteria": {"projects_created": 1}, "points": 25},
+    {"id": "well-rounded", "name": "Well Rounded", "description": "Complete a lesson, a simulation, an ethical decision and a project", "icon": "🌟", "criteria": {"lessons_completed": 1, "simulations_completed": 1, "ethical_decisions": 1, "projects_created": 1}, "points": 100}
+]
+
+class AchievementEngine:
+    """Achievements compiled into counter thresholds, evaluated only for the counters that changed"""
+
+    def __init__(self):
+        self.thresholds: Dict[str, Dict[str, float]] = {}
+        self.points: Dict[str, int] = {}
+        self.by_counter: Dict[str, List[str]] = {}
+
+    def load(self, achievements: List[Dict[str, Any]]):
+        counters = set(ACTIVITY_COUNTERS.values())
+        thresholds, points, by_counter = {}, {}, defaultdict(list)
+        for achievement in achievements:
+            criteria = {
+                counter: threshold for counter, threshold in (achievement.get("criteria") or {}).items()
+                if counter in counters and isinstance(threshold, (int, float)) and threshold > 0
+            }
+            if not criteria:
+                logger.warning(f"Achievement {achievement.get('id')} has no supported criteria")
+                continue
+            thresholds[achievement["id"]] = criteria
+            points[achievement["id"]] = achievement.get("points", 0)
+            for counter in criteria:
+                by_counter[counter].append(achievement["id"])
+        self.thresholds, self.points, self.by_counter = thresholds, points, dict(by_counter)
+
+    def progress(self, stats: Dict[str, Any], achievement_id: str) -> float:
+        criteria = self.thresholds[achievement_id]
+        return sum(min(1.0, stats.get(counter, 0) / threshold) for counter, threshold in criteria.items()) / len(criteria)
+
+    async def apply(self, user_id: str, stats: Dict[str, Any], achievement_ids: List[str]):
+        if not achievement_ids:
+            return
+        now = datetime.utcnow()
+        progress = {achievement_id: self.progress(stats, achievement_id) for achievement_id in achievement_ids}
+        await bulk_upsert(db.user_achievements, [
+            (
+                {"user_id": user_id, "achievement_id": achievement_id},
+                {
+                    "$max": {"progress": value},
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "unlocked": False, "unlocked_at": None, "created_at": now}
+                }
+            )
+            for achievement_id, value in progress.items()
+        ])
+        for achievement_id, value in progress.items():
+            if value < 1.0:
+                continue
+            result = await db.user_achievements.update_one(
+                {"user_id": user_id, "achievement_id": achievement_id, "unlocked": False},
+                {"$set": {"unlocked": True, "unlocked_at": now}}
+            )
+            if result.modified_count and self.points[achievement_id]:
+                await award_points(user_id, self.points[achievement_id])
+
+achievement_engine = AchievementEngine()
+
+async def increment_user_stats(user_id: str, increments: Dict[str, Any]) -> Dict[str, Any]:
+    query = {"user_id": user_id}
+    update = {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}}
+    try:
+        return await db.user_stats.find_one_and_update(
+            query, update, projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return await db.user_stats.find_one_and_update(
+            query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+
+# Append-only activity log, compacted into time buckets by rollup_activity
+ACTIVITY_EVENT_RETENTION_DAYS = int(os.environ.get("ACTIVITY_EVENT_RETENTION_DAYS", "90"))
+
+def activity_event(user_id: str, kind: str, count: int = 1) -> Dict[str, Any]:
+    return {"ts": datetime.utcnow(), "meta": {"user_id": user_id, "kind": kind}, "count": count}
+
+async def log_activity(events: List[Dict[str, Any]]):
+    if events:
+        await db.activity_events.insert_many(events, ordered=False)
+
+async def record_activity(user_id: str, kind: str, count: int = 1, stats: Optional[Dict[str, Any]] = None):
+    """Activity event hook: counters, points and the achievements that depend on this activity
+
+    stats holds extra user_stats increments written in the same $inc.
+    """
+    counter = ACTIVITY_COUNTERS[kind]
+    await log_activity([activity_event(user_id, kind, count)])
+    user_stats = await increment_user_stats(user_id, {counter: count, **(stats or {})})
+    user = await award_points(user_id, ACTIVITY_POINTS[kind] * count)
+    if user:
+        await record_active_day(user_id, user)
+    await achievement_engine.apply(user_id, user_stats, achievement_engine.by_counter.get(counter, []))
+
+STATS_REBUILD_BATCH_SIZE = 500
+
+def completed_simulation(value):
+    return {"$cond": [{"$eq": ["$status", "Completed"]}, value, 0]}
+
+# How each user_stats field is recomputed from its source collection
+USER_STATS_SOURCES = [
+    (db.user_lesson_progress, {"completed": True}, {"lessons_completed": {"$sum": 1}}),
+    (db.user_simulations, {}, {
+        "simulations": {"$sum": 1},
+        "simulations_completed": {"$sum": completed_simulation(1)},
+        "survival_rate_total": {"$sum": completed_simulation("$survival_rate")}
+    }),
+    (db.user_ethical_decisions, {}, {"ethical_decisions": {"$sum": 1}}),
+    (db.projects, {}, {"projects_created": {"$sum": 1}})
+]
+USER_STATS_FIELDS = [field for _, _, accumulators in USER_STATS_SOURCES for field in accumulators]
+
+class ActivityWriteGate:
+    """Activity writes (a source row plus its user_stats $inc) run concurrently,
+    but never alongside a user_stats rebuild, whose $set of recomputed totals
+    would otherwise overwrite increments made while it ran.
+
+    The gate is per process; the backend runs as a single uvicorn process.
+    """
+
+    def __init__(self):
+        self.writers = 0
+        self.paused = False
+        self.changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.paused)
+            self.writers += 1
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.writers -= 1
+                self.changed.notify_all()
+
+    @asynccontextmanager
+    async def pause(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.paused)
+            self.paused = True
+            await self.changed.wait_for(lambda: self.writers == 0)
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.paused = False
+                self.changed.notify_all()
+
+activity_writes = ActivityWriteGate()
+
+async def rebuild_user_stats() -> int:
+    """Recompute every user_stats document from the source collections, streaming per-user groups
+
+    Activity writes are paused for the duration, so nothing can change the
+    sources or user_stats between the aggregation and the overwrite.
+    """
+    async with activity_writes.pause():
+        stats: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for collection, match, accumulators in USER_STATS_SOURCES:
+            pipeline = [{"$match": match}, {"$group": {"_id": "$user_id", **accumulators}}]
+            async for row in collection.aggregate(pipeline, batchSize=STATS_REBUILD_BATCH_SIZE):
+                stats[row.pop("_id")].update(row)
+
+        now = datetime.utcnow()
+        user_ids = list(stats)
+        for i in range(0, len(user_ids), STATS_REBUILD_BATCH_SIZE):
+            await bulk_upsert(db.user_stats, [
+                (
+                    {"user_id": user_id},
+                    {"$set": {**{field: stats[user_id].get(field, 0) for field in USER_STATS_FIELDS}, "updated_at": now}}
+                )
+                for user_id in user_ids[i:i + STATS_REBUILD_BATCH_SIZE]
+            ])
+        # Users with no remaining activity keep a row, reset to zero
+        await db.user_stats.update_many(
+            {"updated_at": {"$lt": now}},
+            {"$set": {**{field: 0 for field in USER_STATS_FIELDS}, "updated_at": now}}
+        )
+    return len(user_ids)
+
+async def backfill_achievements():
+    users = await rebuild_user_stats()
+    all_achievements = list(achievement_engine.thresholds)
+    async for stats in db.user_stats.find({}, {"_id": 0}, batch_size=STATS_REBUILD_BATCH_SIZE):
+        await achievement_engine.apply(stats["user_id"], stats, all_achievements)
+    logger.info(f"Achievement backfill finished for {users} users")
+
 # User Management Endpoints
 @api_router.get("/users", response_model=List[User])
 async def get_users(skip: int = 0, limit: int = 100):
@@ -262,6 +696,7 @@ async def get_user(user_id: str):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    user["streak"] = current_streak(user)
     return serialize_doc(user)
 
 @api_router.put("/users/{user_id}", response_model=User)
@@ -299,59 +734,734 @@ async def update_user(user_id: str, user_data: UserUpdate):
     
     return serialize_doc(user)
 
+QUIZ_ANSWER_FIELDS = ("correct", "explanation")
+QUIZ_ATTEMPT_BATCH_LIMIT = 500
+QUIZ_MAX_OPTION = np.iinfo(np.int16).max
+QUIZ_UNANSWERED = -1
+# Key of a question without a usable answer: matches neither an answer nor QUIZ_UNANSWERED
+QUIZ_NO_KEY = -2
+
+def validate_lesson_content(content: Dict[str, Any]):
+    """Reject section and quiz shapes the lesson cache and quiz grading cannot use"""
+    sections = content.get("sections") or []
+    if not isinstance(sections, list) or not all(isinstance(section, dict) for section in sections):
+        raise HTTPException(status_code=400, detail="content.sections must be a list of objects")
+    section_ids = [section.get("id") for section in sections]
+    if any(section_id is None or isinstance(section_id, (dict, list)) for section_id in section_ids):
+        raise HTTPException(status_code=400, detail="Every section needs a string or number id")
+    if len({str(section_id) for section_id in section_ids}) != len(section_ids):
+        raise HTTPException(status_code=400, detail="Section ids must be unique within a lesson")
+
+    quiz = content.get("quiz") or []
+    if not isinstance(quiz, list):
+        raise HTTPException(status_code=400, detail="content.quiz must be a list of questions")
+    for number, question in enumerate(quiz, 1):
+        if not isinstance(question, dict) or not isinstance(question.get("question"), str):
+            raise HTTPException(status_code=400, detail=f"Quiz question {number} needs question text")
+        options = question.get("options")
+        if not isinstance(options, list) or not options or len(options) > QUIZ_MAX_OPTION + 1:
+            raise HTTPException(status_code=400, detail=f"Quiz question {number} needs a list of options")
+        correct = question.get("correct")
+        if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct < len(options):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Quiz question {number} needs 'correct', the index of its right option"
+            )
+
+def quiz_answer_key(question: Dict[str, Any]) -> int:
+    correct = question.get("correct")
+    if isinstance(correct, bool) or not isinstance(correct, int) or not 0 <= correct <= QUIZ_MAX_OPTION:
+        return QUIZ_NO_KEY
+    return correct
+
+def public_quiz(quiz: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Answer keys stay on the server; quizzes are graded by submit_quiz_attempts
+    return [{k: v for k, v in question.items() if k not in QUIZ_ANSWER_FIELDS} for question in quiz]
+
+def public_lesson(lesson: Dict[str, Any]) -> Dict[str, Any]:
+    content = lesson.get("content") or {}
+    if not content.get("quiz"):
+        return lesson
+    return {**lesson, "content": {**content, "quiz": public_quiz(content["quiz"])}}
+
+def assign_section_bits(sections: List[Dict[str, Any]], existing: Dict[str, int]) -> Dict[str, int]:
+    """Keep every section's completion bit across edits; new sections take the next unused bit"""
+    section_bits = dict(existing)
+    next_bit = max(section_bits.values(), default=-1) + 1
+    for section in sections:
+        section_id = str(section.get("id"))
+        if section_id not in section_bits:
+            section_bits[section_id] = next_bit
+            next_bit += 1
+    return section_bits
+
+def lesson_section_bits(lesson: Dict[str, Any]) -> Dict[str, int]:
+    # Lessons stored before section_bits existed were tracked in section order
+    sections = (lesson.get("content") or {}).get("sections") or []
+    return lesson.get("section_bits") or assign_section_bits(sections, {})
+
+# Lesson payload cache: the full document plus outline, section and quiz
+# slices, serialized and compressed once per lesson version
+class CachedLesson:
+    def __init__(self, lesson: Dict[str, Any]):
+        self.version = lesson.get("version", 1)
+        self.document = CachedPayload(Lesson(**public_lesson(lesson)).dict())
+        content = lesson.get("content") or {}
+        sections = content.get("sections") or []
+        quiz = content.get("quiz") or []
+        self.sections = {str(section.get("id")): CachedPayload(section) for section in sections}
+        # Section completion is tracked as one bit per section; the bit stays with the
+        # section when the lesson is edited, so stored masks never change meaning
+        self.section_list = [{"id": section.get("id"), "title": section.get("title")} for section in sections]
+        self.section_bits = lesson_section_bits(lesson)
+        self.quiz = CachedPayload(public_quiz(quiz))
+        self.answer_key = np.array([quiz_answer_key(question) for question in quiz], dtype=np.int16)
+        self.outline = CachedPayload({
+            "id": lesson["id"],
+            "title": lesson.get("title"),
+            "description": lesson.get("description"),
+            "duration": lesson.get("duration"),
+            "difficulty": lesson.get("difficulty"),
+            "topics": lesson.get("topics", []),
+            "overview": content.get("overview"),
+            "learning_objectives": content.get("learning_objectives", []),
+            "additional_resources": content.get("additional_resources", []),
+            "sections": [
+                {
+                    "id": section.get("id"),
+                    "title": section.get("title"),
+                    "duration": section.get("duration"),
+                    "type": section.get("type")
+                }
+                for section in sections
+            ],
+            "quiz_questions": len(quiz),
+            # Inline the first section so the first paint needs a single request
+            "first_section": sections[0] if sections else None
+        })
+
+lesson_cache: Dict[str, CachedLesson] = {}
+
+def cache_lesson(lesson: Dict[str, Any]) -> CachedLesson:
+    cached = CachedLesson(lesson)
+    current = lesson_cache.get(lesson["id"])
+    # Concurrent updates may finish out of order; never replace a newer version
+    if current is None or current.version <= cached.version:
+        lesson_cache[lesson["id"]] = cached
+    return cached
+
+async def get_cached_lesson(lesson_id: str) -> CachedLesson:
+    cached = lesson_cache.get(lesson_id)
+    if cached is None:
+        lesson = await db.lessons.find_one({"id": lesson_id})
+        if not lesson:
+            raise HTTPException(status_code=404, detail="Lesson not found")
+        cached = cache_lesson(lesson)
+    return cached
+
+# Full-text search
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SEARCH_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "this", "to",
+    "was", "what", "when", "which", "who", "why", "with"
+})
+
+def tokenize(text: str) -> List[str]:
+    # Single letters are mostly contraction fragments ("what's" -> "s") and prefix-match everything
+    return [
+        token for token in SEARCH_TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in SEARCH_STOPWORDS
+    ]
+
+class SearchIndex:
+    """In-memory inverted index with BM25 ranking and prefix matching"""
+
+    # Prefix expansions rank below exact matches of the same term
+    PREFIX_WEIGHT = 0.7
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {key: term frequency}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+        self._vocabulary: Optional[List[str]] = None
+
+    def add(self, key: str, text: str):
+        self.remove(key)
+        terms = tokenize(text)
+        counts = Counter(terms)
+        for term, frequency in counts.items():
+            self.postings.setdefault(term, {})[key] = frequency
+        self.doc_lengths[key] = len(terms)
+        self.doc_terms[key] = list(counts)
+        self.total_length += len(terms)
+        self._vocabulary = None
+
+    def remove(self, key: str):
+        if key not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(key):
+            docs = self.postings[term]
+            del docs[key]
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(key)
+        self._vocabulary = None
+
+    def expand(self, term: str) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        matches = []
+        i = bisect_left(vocabulary, term)
+        while i < len(vocabulary) and vocabulary[i].startswith(term):
+            matches.append(vocabulary[i])
+            i += 1
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[Any]:
+        terms = tokenize(query)
+        if not terms or not self.doc_lengths:
+            return []
+
+        doc_count = len(self.doc_lengths)
+        avg_length = self.total_length / doc_count or 1
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(terms):
+            # Best-scoring expansion per document, so "gene" matching both
+            # "gene" and "genes" in one lesson is not counted twice
+            term_scores: Dict[str, float] = {}
+            for match in self.expand(term):
+                docs = self.postings[match]
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                weight = 1.0 if match == term else self.PREFIX_WEIGHT
+                for key, frequency in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / avg_length)
+                    score = weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    if score > term_scores.get(key, 0.0):
+                        term_scores[key] = score
+            for key, score in term_scores.items():
+                scores[key] += score
+
+        return sorted(scores.items(), key=lambda hit: hit[1], reverse=True)[:limit]
+
+def lesson_search_text(lesson: Dict[str, Any]) -> str:
+    content = lesson.get("content") or {}
+    # Repeat titles and topics to weight them above body text
+    parts = [lesson.get("title", "")] * 3 + list(lesson.get("topics", [])) * 2
+    parts += [lesson.get("description", ""), content.get("overview", "")]
+    for section in content.get("sections") or []:
+        section_content = section.get("content") or {}
+        parts += [section.get("title", ""), section.get("title", ""), section_content.get("text", "")]
+        parts += section_content.get("key_points", [])
+        for case_study in section_content.get("case_studies", []):
+            parts += [case_study.get(field, "") for field in ("title", "description", "outcome", "significance")]
+    return " ".join(part for part in parts if isinstance(part, str))
+
+lesson_search_index = SearchIndex()
+lesson_search_summaries: Dict[str, Dict[str, Any]] = {}
+
+# Passage index for lesson-grounded tutor answers: one entry per section
+# and per case study, so a match points at a self-contained excerpt
+lesson_passage_index = SearchIndex()
+lesson_passages: Dict[str, Dict[str, Any]] = {}
+lesson_passage_keys: Dict[str, List[str]] = {}
+
+def lesson_passage_list(lesson: Dict[str, Any]) -> List[Dict[str, Any]]:
+    passages = []
+    for section in (lesson.get("content") or {}).get("sections") or []:
+        section_content = section.get("content") or {}
+        base = {"lesson_id": lesson["id"], "lesson_title": lesson.get("title"), "section_id": section.get("id")}
+        if section_content.get("text"):
+            passages.append({
+                **base,
+                "key": f"{lesson['id']}/{section.get('id')}",
+                "title": section.get("title", ""),
+                "text": section_content["text"],
+                "key_points": section_content.get("key_points", [])
+            })
+        for i, case_study in enumerate(section_content.get("case_studies", [])):
+            details = [case_study.get(field) for field in ("description", "outcome", "significance")]
+            passages.append({
+                **base,
+                "key": f"{lesson['id']}/{section.get('id')}/case-{i}",
+                "title": case_study.get("title", ""),
+                "text": ". ".join(detail for detail in details if detail) + ".",
+                "key_points": []
+            })
+    return passages
+
+def index_lesson_passages(lesson: Dict[str, Any]):
+    for key in lesson_passage_keys.pop(lesson["id"], []):
+        lesson_passage_index.remove(key)
+        lesson_passages.pop(key, None)
+    passages = lesson_passage_list(lesson)
+    for passage in passages:
+        # Titles are repeated to weight them above body text, as in lesson_search_text
+        text = " ".join([passage["title"], passage["title"], passage["text"], *passage["key_points"]])
+        lesson_passage_index.add(passage["key"], text)
+        lesson_passages[passage["key"]] = passage
+    lesson_passage_keys[lesson["id"]] = [passage["key"] for passage in passages]
+
+def index_lesson(lesson: Dict[str, Any]):
+    lesson_search_index.add(lesson["id"], lesson_search_text(lesson))
+    index_lesson_passages(lesson)
+    lesson_search_summaries[lesson["id"]] = {
+        "id": lesson["id"],
+        "title": lesson.get("title"),
+        "description": lesson.get("description"),
+        "duration": lesson.get("duration"),
+        "difficulty": lesson.get("difficulty"),
+        "topics": lesson.get("topics", [])
+    }
+
+def refresh_lesson(lesson: Dict[str, Any]):
+    """Update the payload cache and search index after a lesson write"""
+    if lesson_cache.get(lesson["id"]) is cache_lesson(lesson):
+        index_lesson(lesson)
+
 # Lesson Management
 @api_router.get("/lessons", response_model=List[Lesson])
 async def get_lessons(skip: int = 0, limit: int = 100):
     lessons = await db.lessons.find().skip(skip).limit(limit).to_list(limit)
-    return [serialize_doc(lesson) for lesson in lessons]
+    return [serialize_doc(public_lesson(lesson)) for lesson in lessons]
+
+@api_router.get("/lessons/search")
+async def search_lessons(q: str, limit: int = 10):
+    hits = lesson_search_index.search(q, limit)
+    return [{**lesson_search_summaries[key], "score": round(score, 4)} for key, score in hits]
 
 @api_router.get("/lessons/{lesson_id}", response_model=Lesson)
-async def get_lesson(lesson_id: str):
-    lesson = await db.lessons.find_one({"id": lesson_id})
-    if not lesson:
-        raise HTTPException(status_code=404, detail="Lesson not found")
-    return serialize_doc(lesson)
+async def get_lesson(lesson_id: str, request: Request):
+    cached = await get_cached_lesson(lesson_id)
+    return payload_response(request, cached.document)
 
 @api_router.post("/lessons", response_model=Lesson)
 async def create_lesson(lesson_data: LessonCreate):
+    validate_lesson_content(lesson_data.content)
     lesson = Lesson(**lesson_data.dict())
+    lesson.section_bits = assign_section_bits(lesson.content.get("sections") or [], {})
     await db.lessons.insert_one(lesson.dict())
+    refresh_lesson(lesson.dict())
     return lesson
 
+@api_router.put("/lessons/{lesson_id}", response_model=Lesson)
+async def update_lesson(lesson_id: str, lesson_data: LessonUpdate):
+    update_data = {k: v for k, v in lesson_data.dict().items() if v is not None}
+    query = {"id": lesson_id}
+    if "content" in update_data:
+        validate_lesson_content(update_data["content"])
+        current = await db.lessons.find_one({"id": lesson_id})
+        if not current:
+            raise HTTPException(status_code=404, detail="Lesson not found")
+        update_data["section_bits"] = assign_section_bits(
+            update_data["content"].get("sections") or [], lesson_section_bits(current)
+        )
+        # The bit map was derived from this version; a concurrent edit must not be overwritten.
+        # Lessons stored before versioning have no version field until their first edit
+        query["version"] = current["version"] if "version" in current else {"$exists": False}
+    update = {"$inc": {"version": 1}}
+    if update_data:
+        update["$set"] = update_data
+
+    lesson = await db.lessons.find_one_and_update(
+        query,
+        update,
+        return_document=ReturnDocument.AFTER
+    )
+    if not lesson:
+        if "version" in query:
+            raise HTTPException(status_code=409, detail="Lesson was modified concurrently, please retry")
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+    refresh_lesson(lesson)
+    return serialize_doc(lesson)
+
+@api_router.get("/lessons/{lesson_id}/outline")
+async def get_lesson_outline(lesson_id: str, request: Request):
+    """Lesson metadata, section titles and the first section"""
+    cached = await get_cached_lesson(lesson_id)
+    return payload_response(request, cached.outline)
+
+@api_router.get("/lessons/{lesson_id}/sections/{section_id}")
+async def get_lesson_section(lesson_id: str, section_id: str, request: Request):
+    cached = await get_cached_lesson(lesson_id)
+    section = cached.sections.get(section_id)
+    if section is None:
+        raise HTTPException(status_code=404, detail="Section not found")
+    return payload_response(request, section)
+
+@api_router.get("/lessons/{lesson_id}/quiz")
+async def get_lesson_quiz(lesson_id: str, request: Request):
+    cached = await get_cached_lesson(lesson_id)
+    return payload_response(request, cached.quiz)
+
+@api_router.post("/lessons/{lesson_id}/quiz/attempts")
+async def submit_quiz_attempts(lesson_id: str, batch: QuizAttemptBatch):
+    """Grade one or more quiz attempts, e.g. a whole class syncing after an offline session"""
+    cached = await get_cached_lesson(lesson_id)
+    answer_key = cached.answer_key
+    if len(answer_key) == 0:
+        raise HTTPException(status_code=400, detail="Lesson has no quiz")
+    if not batch.attempts:
+        raise HTTPException(status_code=400, detail="No quiz attempts submitted")
+    if len(batch.attempts) > QUIZ_ATTEMPT_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {QUIZ_ATTEMPT_BATCH_LIMIT} attempts per request")
+    for attempt in batch.attempts:
+        # Unanswered questions are sent as null, so every attempt covers the whole quiz
+        if len(attempt.answers) != len(answer_key):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Attempt {attempt.id} must have {len(answer_key)} answers, use null for unanswered"
+            )
+        if all(answer is None for answer in attempt.answers):
+            raise HTTPException(status_code=400, detail=f"Attempt {attempt.id} has no answers")
+    user_ids = {attempt.user_id for attempt in batch.attempts}
+    known_users = await db.users.distinct("id", {"id": {"$in": list(user_ids)}})
+    unknown_users = user_ids - set(known_users)
+    if unknown_users:
+        raise HTTPException(status_code=404, detail=f"Unknown users: {sorted(unknown_users)}")
+
+    # Grade the whole batch at once: one row per attempt, QUIZ_UNANSWERED for unanswered
+    answers = np.full((len(batch.attempts), len(answer_key)), QUIZ_UNANSWERED, dtype=np.int16)
+    for row, attempt in enumerate(batch.attempts):
+        given = [
+            answer if answer is not None and 0 <= answer <= QUIZ_MAX_OPTION else QUIZ_UNANSWERED
+            for answer in attempt.answers
+        ]
+        answers[row] = given
+    correct = answers == answer_key
+    scores = correct.sum(axis=1)
+
+    # Attempt ids make re-uploads idempotent; only newly stored attempts count towards stats
+    attempt_ops = []
+    for attempt, score, attempt_correct in zip(batch.attempts, scores, correct):
+        attempt_ops.append(UpdateOne(
+            {"id": attempt.id},
+            {"$setOnInsert": {
+                **attempt.dict(),
+                "lesson_id": lesson_id,
+                "lesson_version": cached.version,
+                "score": int(score),
+                "total": len(answer_key),
+                "correct": attempt_correct.tolist(),
+                "graded_at": datetime.utcnow()
+            }},
+            upsert=True
+        ))
+    result = await db.quiz_attempts.bulk_write(attempt_ops, ordered=False)
+    new_rows = sorted(result.upserted_ids)
+
+    if new_rows:
+        answered_counts = (answers[new_rows] >= 0).sum(axis=0)
+        correct_counts = correct[new_rows].sum(axis=0)
+        await db.quiz_question_stats.bulk_write([
+            UpdateOne(
+                {"lesson_id": lesson_id, "question": question},
+                {"$inc": {
+                    "attempts": len(new_rows),
+                    "answered": int(answered_counts[question]),
+                    "correct": int(correct_counts[question])
+                }},
+                upsert=True
+            )
+            for question in range(len(answer_key))
+        ], ordered=False)
+
+    return {
+        "lesson_id": lesson_id,
+        "recorded": len(new_rows),
+        "duplicates": len(batch.attempts) - len(new_rows),
+        "results": [
+            {
+                "attempt_id": attempt.id,
+                "user_id": attempt.user_id,
+                "score": int(score),
+                "total": len(answer_key),
+                "percentage": round(100 * float(score) / len(answer_key), 1),
+                "correct": attempt_correct.tolist()
+            }
+            for attempt, score, attempt_correct in zip(batch.attempts, scores, correct)
+        ]
+    }
+
 # User Lesson Progress
 @api_router.get("/users/{user_id}/lessons/progress")
 async def get_user_lesson_progress(user_id: str):
+    # Make this user's buffered progress visible; other users' entries keep coalescing
+    try:
+        await progress_buffer.flush(user_id)
+    except Exception:
+        # The entries stay buffered for the next flush; serve what is stored
+        logger.exception(f"Failed to flush lesson progress for user {user_id}")
     progress = await db.user_lesson_progress.find({"user_id": user_id}).to_list(1000)
     return [serialize_doc(p) for p in progress]
 
+def lesson_progress_update(user_id: str, lesson_id: str, progress: int, now: datetime, completed_at: Optional[datetime] = None):
+    """Filter and update for a single-round-trip progress upsert
+
+    completed_at defaults to now; synced offline completions pass the time they happened.
+    """
+    query = {"user_id": user_id, "lesson_id": lesson_id}
+    update = {
+        "$max": {"progress": progress},
+        "$set": {"updated_at": now},
+        "$setOnInsert": {"id": str(uuid.uuid4()), "started_at": now}
+    }
+    if progress >= 100:
+        # Only an uncompleted row matches, so completed_at is set exactly once
+        query["completed_at"] = None
+        update["$set"].update({"completed": True, "completed_at": completed_at or now})
+    else:
+        update["$setOnInsert"].update({"completed": False, "completed_at": None})
+    return query, update
+
+async def write_lesson_progress(user_id: str, lesson_id: str, progress: int, completed_at: Optional[datetime] = None) -> bool:
+    """Upsert progress, returning True if this write completed the lesson"""
+    query, update = lesson_progress_update(user_id, lesson_id, progress, datetime.utcnow(), completed_at)
+    try:
+        result = await db.user_lesson_progress.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # Either the lesson is already completed or a concurrent request
+        # inserted the row first; retry as a plain update
+        result = await db.user_lesson_progress.update_one(query, update)
+    return progress >= 100 and (result.upserted_id is not None or result.modified_count > 0)
+
+async def apply_lesson_progress(entries: Dict[Any, int], completed_times: Optional[Dict[Any, datetime]] = None) -> List[Any]:
+    """Write many (user_id, lesson_id) -> progress entries, returning the ones that completed a lesson
+
+    completed_times optionally maps entries to when the lesson was actually completed.
+    """
+    now = datetime.utcnow()
+    completed = []
+    updates = []
+    for (user_id, lesson_id), progress in entries.items():
+        if progress >= 100:
+            # Completions are rare and go one by one so each transition is observed
+            completed_at = (completed_times or {}).get((user_id, lesson_id))
+            async with activity_writes.write():
+                if await write_lesson_progress(user_id, lesson_id, progress, completed_at):
+                    completed.append((user_id, lesson_id))
+                    await record_activity(user_id, "lesson_completed")
+        else:
+            updates.append(lesson_progress_update(user_id, lesson_id, progress, now))
+
+    await bulk_upsert(db.user_lesson_progress, updates)
+    await log_activity([
+        activity_event(user_id, "lesson_progress") for user_id, _ in entries
+    ])
+    return completed
+
+async def merge_duplicate_lesson_progress():
+    """Collapse rows duplicated by the old find-then-insert write into one per (user, lesson)"""
+    pipeline = [
+        {"$group": {
+            "_id": {"user_id": "$user_id", "lesson_id": "$lesson_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+            "progress": {"$max": "$progress"},
+            "completed": {"$max": "$completed"},
+            "started_at": {"$min": "$started_at"},
+            "completed_at": {"$min": "$completed_at"},
+            "updated_at": {"$max": "$updated_at"}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    merged = 0
+    async for group in db.user_lesson_progress.aggregate(pipeline, allowDiskUse=True):
+        keep, *duplicates = group["ids"]
+        # $min skips nulls, so completed_at is the first real completion
+        await db.user_lesson_progress.update_one({"_id": keep}, {"$set": {
+            field: group[field] for field in ("progress", "completed", "started_at", "completed_at", "updated_at")
+        }})
+        await db.user_lesson_progress.delete_many({"_id": {"$in": duplicates}})
+        merged += len(duplicates)
+    if merged:
+        logger.warning(f"Merged {merged} duplicate lesson progress rows")
+
+class ProgressWriteBuffer:
+    """Write-behind buffer keeping the highest pending progress per (user, lesson)"""
+
+    def __init__(self, flush_interval: float, max_entries: int):
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.pending: Dict[Any, int] = {}
+        self.received = 0
+        self.flushed = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def add(self, user_id: str, lesson_id: str, progress: int):
+        key = (user_id, lesson_id)
+        self.pending[key] = max(progress, self.pending.get(key, progress))
+        self.received += 1
+        if len(self.pending) >= self.max_entries:
+            await self.flush()
+
+    async def flush(self, user_id: Optional[str] = None):
+        """Write pending progress, only the given user's when user_id is set"""
+        async with self._lock:
+            if user_id is None:
+                entries, self.pending = self.pending, {}
+            else:
+                entries = {key: progress for key, progress in self.pending.items() if key[0] == user_id}
+                for key in entries:
+                    del self.pending[key]
+            if not entries:
+                return
+            try:
+                await apply_lesson_progress(entries)
+            except BaseException:
+                # Put the entries back so the next flush retries them, also when
+                # cancelled mid-write; re-applying is safe since writes use $max
+                for key, progress in entries.items():
+                    self.pending[key] = max(progress, self.pending.get(key, progress))
+                raise
+            self.flushed += len(entries)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush lesson progress")
+
+    def start(self):
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # Let a flush in progress finish instead of cancelling it halfway
+        if self._task:
+            self._stopping.set()
+            await self._task
+        await self.flush()
+
+progress_buffer = ProgressWriteBuffer(
+    flush_interval=int(os.environ.get("PROGRESS_FLUSH_INTERVAL_MS", "500")) / 1000,
+    max_entries=int(os.environ.get("PROGRESS_FLUSH_MAX_ENTRIES", "500"))
+)
+
 @api_router.post("/users/{user_id}/lessons/{lesson_id}/progress")
 async def update_lesson_progress(user_id: str, lesson_id: str, progress: int):
-    existing = await db.user_lesson_progress.find_one({"user_id": user_id, "lesson_id": lesson_id})
-    
-    if existing:
-        update_data = {
-            "progress": progress,
-            "completed": progress >= 100,
-            "updated_at": datetime.utcnow()
+    await progress_buffer.add(user_id, lesson_id, progress)
+    return {"message": "Progress updated successfully"}
+
+# Section completion, stored as a bitset on the progress row (bits from the lesson's section_bits)
+MAX_TRACKED_SECTIONS = 63  # bits of a signed 64-bit integer
+
+def completed_section_ids(cached: CachedLesson, mask: int) -> List[Any]:
+    return [
+        section["id"] for section in cached.section_list
+        if mask >> cached.section_bits[str(section["id"])] & 1
+    ]
+
+@api_router.post("/users/{user_id}/lessons/{lesson_id}/sections/{section_id}/complete")
+async def complete_lesson_section(user_id: str, lesson_id: str, section_id: str):
+    cached = await get_cached_lesson(lesson_id)
+    bit = cached.section_bits.get(section_id)
+    if bit is None:
+        raise HTTPException(status_code=404, detail="Section not found")
+    if bit >= MAX_TRACKED_SECTIONS:
+        raise HTTPException(status_code=400, detail="Section completion is tracked for the first 63 sections of a lesson only")
+
+    now = datetime.utcnow()
+    query = {"user_id": user_id, "lesson_id": lesson_id}
+    update = {
+        "$bit": {"sections_completed": {"or": Int64(1 << bit)}},
+        "$set": {"updated_at": now},
+        "$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "progress": 0,
+            "completed": False,
+            "completed_at": None,
+            "started_at": now
         }
-        if progress >= 100:
-            update_data["completed_at"] = datetime.utcnow()
-            
-        await db.user_lesson_progress.update_one(
-            {"user_id": user_id, "lesson_id": lesson_id},
-            {"$set": update_data}
+    }
+    try:
+        progress = await db.user_lesson_progress.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
         )
-    else:
-        progress_data = UserLessonProgress(
-            user_id=user_id,
-            lesson_id=lesson_id,
-            progress=progress,
-            completed=progress >= 100,
-            completed_at=datetime.utcnow() if progress >= 100 else None
+    except DuplicateKeyError:
+        progress = await db.user_lesson_progress.find_one_and_update(
+            query, update, return_document=ReturnDocument.AFTER
         )
-        await db.user_lesson_progress.insert_one(progress_data.dict())
-    
-    return {"message": "Progress updated successfully"}
+
+    completed = completed_section_ids(cached, progress.get("sections_completed", 0))
+    return {
+        "lesson_id": lesson_id,
+        "completed_sections": completed,
+        "total_sections": len(cached.section_list)
+    }
+
+@api_router.get("/users/{user_id}/lessons/sections")
+async def get_user_completed_sections(user_id: str):
+    """Completed sections of every lesson the user has started"""
+    rows = await db.user_lesson_progress.find(
+        {"user_id": user_id},
+        {"_id": 0, "lesson_id": 1, "sections_completed": 1}
+    ).to_list(1000)
+
+    results = []
+    for row in rows:
+        try:
+            cached = await get_cached_lesson(row["lesson_id"])
+        except HTTPException:
+            continue
+        results.append({
+            "lesson_id": row["lesson_id"],
+            "completed_sections": completed_section_ids(cached, row.get("sections_completed", 0)),
+            "total_sections": len(cached.section_list)
+        })
+    return results
+
+@api_router.get("/analytics/lessons/{lesson_id}/sections")
+async def get_class_section_completion(lesson_id: str, school: Optional[str] = None, grade: Optional[str] = None):
+    """Per-section completion across a school or class"""
+    cached = await get_cached_lesson(lesson_id)
+    query = {"lesson_id": lesson_id}
+    user_filter = {k: v for k, v in {"school": school, "grade": grade}.items() if v is not None}
+    if user_filter:
+        query["user_id"] = {"$in": await db.users.distinct("id", user_filter)}
+
+    masks = [
+        row.get("sections_completed", 0)
+        async for row in db.user_lesson_progress.find(query, {"_id": 0, "sections_completed": 1})
+    ]
+    tracked = [
+        section for section in cached.section_list
+        if cached.section_bits[str(section["id"])] < MAX_TRACKED_SECTIONS
+    ]
+    section_count = len(tracked)
+    positions = np.array([cached.section_bits[str(section["id"])] for section in tracked], dtype=np.int64)
+    # students x sections matrix of completion bits
+    bits = (np.array(masks, dtype=np.int64).reshape(-1, 1) >> positions) & 1
+    per_section = bits.sum(axis=0)
+    per_student = bits.sum(axis=1)
+    students = len(masks)
+
+    return {
+        "lesson_id": lesson_id,
+        "students": students,
+        "students_completed_all": int((per_student == section_count).sum()) if section_count else 0,
+        "average_sections_completed": round(float(per_student.mean()), 2) if students else 0.0,
+        "sections": [
+            {
+                **section,
+                "completed": int(per_section[column]),
+                "completion_rate": round(100 * float(per_section[column]) / students, 1) if students else 0.0
+            }
+            for column, section in enumerate(tracked)
+        ]
+    }
 
 # Simulations
 @api_router.get("/simulations", response_model=List[Simulation])
@@ -658,7 +1768,13 @@ async def run_custom_simulation(request: CustomSimulationRequest):
         }
     )
     
-    await db.user_simulations.insert_one(user_sim.dict())
+    async with activity_writes.write():
+        await db.user_simulations.insert_one(user_sim.dict())
+        await record_activity(
+            request.user_id,
+            "simulation_completed",
+            stats={"simulations": 1, "survival_rate_total": final_survival_rate}
+        )
     
     return {
         "simulation_id": custom_sim.id,
@@ -709,7 +1825,10 @@ async def start_user_simulation(user_id: str, simulation_id: str):
         simulation_id=simulation_id,
         status="Active"
     )
-    await db.user_simulations.insert_one(user_sim.dict())
+    async with activity_writes.write():
+        await db.user_simulations.insert_one(user_sim.dict())
+        await increment_user_stats(user_id, {"simulations": 1})
+    await log_activity([activity_event(user_id, "simulation_started")])
     return {"message": "Simulation started successfully"}
 
 # Ethical Scenarios
@@ -739,7 +1858,9 @@ async def submit_ethical_decision(user_id: str, scenario_id: str, selected_optio
         selected_option=selected_option,
         reasoning=reasoning
     )
-    await db.user_ethical_decisions.insert_one(decision.dict())
+    async with activity_writes.write():
+        await db.user_ethical_decisions.insert_one(decision.dict())
+        await record_activity(user_id, "ethical_decision")
     return {"message": "Decision submitted successfully"}
 
 @api_router.get("/users/{user_id}/ethics/decisions")
@@ -748,121 +1869,1013 @@ async def get_user_ethical_decisions(user_id: str):
     return [serialize_doc(decision) for decision in decisions]
 
 # AI Chat System
+TUTOR_SYSTEM_MESSAGE = "You are an expert biology tutor specializing in gene editing, CRISPR technology, climate adaptation, and ethical considerations in biotechnology. You help high school students understand complex genetic concepts through clear explanations, examples, and interactive discussions. You can provide quizzes, explain ethical dilemmas, and guide students through genetic engineering applications for climate change adaptation."
+TUTOR_PROVIDER = "openai"
+TUTOR_MODEL = "gpt-4o"
+TUTOR_MAX_TOKENS = 4096
+
+# LLM backends: chat clients expose async send_message(UserMessage) -> str
+# and optionally an async-iterator stream_message(UserMessage)
+class LLMBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def create_chat(self, session_id: str, system_message: str) -> Any:
+        """Return a chat client with async send_message and stream_message"""
+
+class LlmChatBackend(LLMBackend):
+    name = "llmchat"
+
+    def create_chat(self, session_id: str, system_message: str) -> Any:
+        return LlmChat(
+            api_key=openai_api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(TUTOR_PROVIDER, TUTOR_MODEL).with_max_tokens(TUTOR_MAX_TOKENS)
+
+class FakeChat:
+    def __init__(self, backend: "FakeLLMBackend", session_id: str):
+        self.backend = backend
+        self.session_id = session_id
+
+    def reply_tokens(self, message: UserMessage) -> List[str]:
+        words = ["Simulated", "tutor", "answer", "about:", *message.text.split()[:20]]
+        filler = ("gene", "editing", "helps", "crops", "adapt", "to", "a", "changing", "climate.")
+        for i in range(self.backend.reply_tokens - len(words)):
+            words.append(filler[i % len(filler)])
+        return [word + " " for word in words[:self.backend.reply_tokens]]
+
+    async def send_message(self, message: UserMessage) -> str:
+        tokens = self.reply_tokens(message)
+        await asyncio.sleep(self.backend.first_token_delay() + len(tokens) * self.backend.token_delay)
+        self.backend.maybe_fail()
+        return "".join(tokens).strip()
+
+    async def stream_message(self, message: UserMessage):
+        await asyncio.sleep(self.backend.first_token_delay())
+        self.backend.maybe_fail()
+        for token in self.reply_tokens(message):
+            yield token
+            await asyncio.sleep(self.backend.token_delay)
+
+class FakeLLMBackend(LLMBackend):
+    """Local stand-in for load tests: log-normal latency, token streaming and injected errors"""
+    name = "fake"
+
+    def __init__(self, median_latency: float, latency_sigma: float, token_delay: float,
+                 reply_tokens: int, error_rate: float, seed: Optional[int] = None):
+        self.median_latency = median_latency
+        self.latency_sigma = latency_sigma
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def first_token_delay(self) -> float:
+        if self.median_latency <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.median_latency), self.latency_sigma)
+
+    def maybe_fail(self):
+        if self.random.random() < self.error_rate:
+            raise RuntimeError("Injected fake LLM backend failure")
+
+    def create_chat(self, session_id: str, system_message: str) -> Any:
+        return FakeChat(self, session_id)
+
+def create_llm_backend(name: str) -> LLMBackend:
+    if name == LlmChatBackend.name:
+        return LlmChatBackend()
+    if name == FakeLLMBackend.name:
+        seed = os.environ.get("FAKE_LLM_SEED")
+        return FakeLLMBackend(
+            median_latency=float(os.environ.get("FAKE_LLM_LATENCY_MS", "800")) / 1000,
+            latency_sigma=float(os.environ.get("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+            token_delay=float(os.environ.get("FAKE_LLM_TOKEN_DELAY_MS", "20")) / 1000,
+            reply_tokens=int(os.environ.get("FAKE_LLM_REPLY_TOKENS", "80")),
+            error_rate=float(os.environ.get("FAKE_LLM_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None
+        )
+    raise ValueError(f"Unknown LLM_BACKEND '{name}', expected '{LlmChatBackend.name}' or '{FakeLLMBackend.name}'")
+
+llm_backend = create_llm_backend(os.environ.get("LLM_BACKEND", LlmChatBackend.name))
+
+class ChatClientManager:
+    """LRU of chat clients per chat session, with idle eviction.
+
+    An LlmChat client keeps its own message history, so it is rebuilt from the
+    session's stored context once it has sent max_turns turns; together
+    with the rolling summary this bounds the prompt size per turn.
+    """
+
+    def __init__(self, max_sessions: int, idle_timeout: float, max_turns: int):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_turns = max_turns
+        self.clients = OrderedDict()  # session_id -> [client, last used, turns sent]
+
+    def build(self, session_id: str, context: Optional[Dict[str, Any]] = None) -> Any:
+        system_message = TUTOR_SYSTEM_MESSAGE
+        if context:
+            system_message += "\n\n" + context_prompt(context)
+        return llm_backend.create_chat(session_id, system_message)
+
+    def needs_context(self, session_id: str) -> bool:
+        entry = self.clients.get(session_id)
+        return entry is None or entry[2] >= self.max_turns
+
+    def get(self, session_id: str, context: Optional[Dict[str, Any]] = None) -> Any:
+        now = time.monotonic()
+        self.evict_idle(now)
+        entry = self.clients.pop(session_id, None)
+        if entry is None or entry[2] >= self.max_turns:
+            entry = [self.build(session_id, context), now, 0]
+        entry[1] = now
+        entry[2] += 1
+        self.clients[session_id] = entry
+        while len(self.clients) > self.max_sessions:
+            self.clients.popitem(last=False)
+        return entry[0]
+
+    def discard(self, session_id: str):
+        self.clients.pop(session_id, None)
+
+    def evict_idle(self, now: float):
+        # Least recently used first, so stop at the first client still in use
+        while self.clients:
+            session_id, entry = next(iter(self.clients.items()))
+            if now - entry[1] < self.idle_timeout:
+                break
+            del self.clients[session_id]
+
+# Chat context budget: the last CHAT_CONTEXT_RECENT_TURNS turns are kept
+# verbatim in chat_sessions, older turns are folded into a rolling
+# extractive summary capped at CHAT_SUMMARY_MAX_LINES lines
+CHAT_CONTEXT_RECENT_TURNS = int(os.environ.get("CHAT_CONTEXT_RECENT_TURNS", "6"))
+CHAT_SUMMARY_MAX_LINES = int(os.environ.get("CHAT_SUMMARY_MAX_LINES", "12"))
+CHAT_SUMMARY_SNIPPET_CHARS = 160
+
+def first_sentence(text: str) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    if len(sentence) > CHAT_SUMMARY_SNIPPET_CHARS:
+        sentence = sentence[:CHAT_SUMMARY_SNIPPET_CHARS - 3].rstrip() + "..."
+    return sentence
+
+def summarize_turn(turn: Dict[str, str]) -> str:
+    return f"Student asked: {first_sentence(turn['user'])} Tutor: {first_sentence(turn['ai'])}"
+
+def context_prompt(context: Dict[str, Any]) -> str:
+    parts = []
+    if context.get("summary"):
+        parts.append("Summary of the earlier conversation:\n" + "\n".join(f"- {line}" for line in context["summary"]))
+    if context.get("recent_turns"):
+        turns = [f"Student: {turn['user']}\nTutor: {turn['ai']}" for turn in context["recent_turns"]]
+        parts.append("Most recent turns:\n" + "\n".join(turns))
+    return "\n\n".join(parts)
+
+async def load_chat_context(session_id: str) -> Optional[Dict[str, Any]]:
+    return await db.chat_sessions.find_one({"session_id": session_id}, {"_id": 0, "summary": 1, "recent_turns": 1})
+
+async def current_chat_context(session_id: str) -> Optional[Dict[str, Any]]:
+    """The stored context once this session's queued turns, which update it, are written"""
+    if not await chat_writer.flush_session(session_id, CHAT_READ_FLUSH_TIMEOUT):
+        logger.warning(f"Loading chat context for session {session_id} with turns still queued")
+    return await load_chat_context(session_id)
+
+def fold_chat_context(context: Optional[Dict[str, Any]], turns: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Append turns to a context, folding the oldest turns past the budget into the summary"""
+    context = context or {}
+    recent_turns = context.get("recent_turns", []) + turns
+    summary = context.get("summary", [])
+    overflow = len(recent_turns) - CHAT_CONTEXT_RECENT_TURNS
+    if overflow > 0:
+        summary = (summary + [summarize_turn(turn) for turn in recent_turns[:overflow]])[-CHAT_SUMMARY_MAX_LINES:]
+        recent_turns = recent_turns[overflow:]
+    return {"summary": summary, "recent_turns": recent_turns}
+
+async def update_chat_context(session_id: str, user_id: str, turns: List[Dict[str, str]]):
+    context = fold_chat_context(await load_chat_context(session_id), turns)
+    now = datetime.utcnow()
+    await db.chat_sessions.update_one(
+        {"session_id": session_id},
+        {
+            "$set": {"user_id": user_id, **context, "updated_at": now},
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
+
+# LLM concurrency limits: a global cap on in-flight provider calls with a
+# bounded wait queue, a per-user cap, and a deadline on every call
+class LLMConcurrencyLimiter:
+    def __init__(self, max_concurrent: int, max_per_user: int, max_queue: int, queue_timeout: float, call_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.user_calls = Counter()
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.calls = 0
+        self.total_call_time = 0.0
+
+    def retry_after(self) -> int:
+        # Roughly the time for the calls ahead of a new request to drain
+        average_call = self.total_call_time / self.calls if self.calls else self.call_timeout / 4
+        return max(1, math.ceil(average_call * (self.waiting / self.max_concurrent + 1)))
+
+    def reject(self, reason: str):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Tutor is busy: {reason}",
+            headers={"Retry-After": str(self.retry_after())}
+        )
+
+    async def acquire(self, user_id: str):
+        if self.user_calls[user_id] >= self.max_per_user:
+            self.reject("too many questions in progress for this user")
+        # Counted synchronously; Semaphore.locked() lags behind callers still being scheduled
+        if self.in_flight + self.waiting >= self.max_concurrent + self.max_queue:
+            self.reject("request queue is full")
+        self.user_calls[user_id] += 1
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.release_user(user_id)
+            self.queue_timeouts += 1
+            self.reject("timed out waiting for a free slot")
+        except BaseException:
+            # Cancelled while queued, e.g. the client went away
+            self.release_user(user_id)
+            raise
+        finally:
+            self.waiting -= 1
+        wait = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_flight += 1
+
+    async def try_acquire_spare(self) -> bool:
+        """Take a free slot for a hedged call, never ahead of queued requests"""
+        if self.waiting or self.slots.locked():
+            return False
+        # A free slot is taken without suspending, so nothing can claim it in between
+        await self.slots.acquire()
+        self.in_flight += 1
+        return True
+
+    def release_spare(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+    def release(self, user_id: str, call_time: float):
+        self.in_flight -= 1
+        self.calls += 1
+        self.total_call_time += call_time
+        self.slots.release()
+        self.release_user(user_id)
+
+    def release_user(self, user_id: str):
+        self.user_calls[user_id] -= 1
+        if self.user_calls[user_id] <= 0:
+            del self.user_calls[user_id]
+
+    async def call(self, user_id: str, make_call):
+        await self.acquire(user_id)
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(make_call(), self.call_timeout)
+        finally:
+            self.release(user_id, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+            "avg_wait_ms": round(1000 * self.total_wait / self.admitted, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 1),
+            "avg_call_ms": round(1000 * self.total_call_time / self.calls, 1) if self.calls else 0.0
+        }
+
+llm_limiter = LLMConcurrencyLimiter(
+    max_concurrent=int(os.environ.get("LLM_MAX_CONCURRENT", "10")),
+    max_per_user=int(os.environ.get("LLM_MAX_CONCURRENT_PER_USER", "2")),
+    max_queue=int(os.environ.get("LLM_MAX_QUEUE", "50")),
+    queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", "10")),
+    call_timeout=float(os.environ.get("LLM_CALL_TIMEOUT_SECONDS", "30"))
+)
+
+# Circuit breaker: consecutive provider errors or slow calls open the
+# circuit, chat endpoints then answer with their fallback straight away
+# until a single probe call after the cool-down succeeds
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, slow_call_seconds: float, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started: Optional[float] = None
+        self.trips = 0
+        self.short_circuited = 0
+        self.latencies = deque(maxlen=200)
+
+    def check(self):
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probe_started = None
+        if self.state == self.HALF_OPEN:
+            # One probe at a time; a probe that never reported back expires
+            if self.probe_started is None or now - self.probe_started >= self.reset_timeout:
+                self.probe_started = now
+                return
+        if self.state != self.CLOSED:
+            self.short_circuited += 1
+            raise CircuitOpenError("LLM provider circuit is open")
+
+    def record(self, success: bool, duration: float):
+        if success:
+            self.latencies.append(duration)
+        if success and duration <= self.slow_call_seconds:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.probe_started = None
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies, q))
+
+    def status(self) -> Dict[str, Any]:
+        p95 = self.percentile(95)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "short_circuited": self.short_circuited,
+            "p95_latency_ms": round(1000 * p95, 1) if p95 is not None else None
+        }
+
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_SAMPLES = 20
+hedge_counts = Counter()
+
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURE_THRESHOLD", "5")),
+    slow_call_seconds=float(os.environ.get("LLM_BREAKER_SLOW_CALL_SECONDS", "20")),
+    reset_timeout=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+)
+
+async def hedged_send(session_id: str, chat: Any, prompt: str, first_turn: bool) -> str:
+    """Send the prompt; past the p95 latency, race a second call on a fresh client
+
+    A hedge only runs in a spare limiter slot, so hedging never exceeds
+    LLM_MAX_CONCURRENT and stops by itself when the provider slows down
+    and the slots fill up.
+    """
+    primary = asyncio.create_task(chat.send_message(UserMessage(text=prompt)))
+    hedge = None
+    try:
+        delay = llm_breaker.percentile(95) if LLM_HEDGE_ENABLED else None
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not await llm_limiter.try_acquire_spare():
+            hedge_counts["skipped"] += 1
+            return await primary
+
+        hedge_counts["sent"] += 1
+        try:
+            context = None if first_turn else await current_chat_context(session_id)
+            hedge = asyncio.create_task(chat_clients.build(session_id, context).send_message(UserMessage(text=prompt)))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            hedge_counts["won"] += 1
+                            # The pooled client missed this turn; rebuild it from stored context
+                            chat_clients.discard(session_id)
+                        return task.result()
+            return primary.result()
+        finally:
+            if hedge is not None:
+                hedge.cancel()
+            llm_limiter.release_spare()
+    finally:
+        primary.cancel()
+
+async def guarded_send(session_id: str, chat: Any, prompt: str, first_turn: bool) -> str:
+    # Timed inside the limiter so queueing is not mistaken for a slow provider
+    started = time.monotonic()
+    try:
+        reply = await hedged_send(session_id, chat, prompt, first_turn)
+    except BaseException:
+        # Includes cancellation by the limiter's call deadline
+        llm_breaker.record(False, time.monotonic() - started)
+        raise
+    llm_breaker.record(True, time.monotonic() - started)
+    return reply
+
+async def session_chat_client(session_id: str, first_turn: bool = False, context: Optional[Dict[str, Any]] = None) -> Any:
+    """The session's pooled client, built from context or the stored context when missing"""
+    if context is None and not first_turn and chat_clients.needs_context(session_id):
+        context = await current_chat_context(session_id)
+    return chat_clients.get(session_id, context)
+
+chat_clients = ChatClientManager(
+    max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", "500")),
+    idle_timeout=int(os.environ.get("CHAT_SESSION_IDLE_SECONDS", "1800")),
+    max_turns=CHAT_CONTEXT_RECENT_TURNS
+)
+
+# Bumps whenever the tutor prompt changes, so cached answers never outlive it
+TUTOR_PROMPT_VERSION = hashlib.sha1(TUTOR_SYSTEM_MESSAGE.encode("utf-8")).hexdigest()[:12]
+
+def normalize_question(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+class AnswerCache:
+    """TTL + LRU cache of tutor answers to opening questions"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (answer, expires at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, question: str) -> str:
+        raw = f"{llm_backend.name}:{TUTOR_PROVIDER}/{TUTOR_MODEL}|{TUTOR_PROMPT_VERSION}|{normalize_question(question)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, question: str) -> Optional[str]:
+        key = self.key(question)
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, question: str, answer: str):
+        key = self.key(question)
+        self.entries[key] = (answer, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+answer_cache = AnswerCache(
+    max_entries=int(os.environ.get("CHAT_ANSWER_CACHE_SIZE", "1000")),
+    ttl=int(os.environ.get("CHAT_ANSWER_CACHE_TTL_SECONDS", "86400"))
+)
+
+# Lesson-grounded answering. BM25 scores shift with corpus size, so the
+# decision uses term coverage: a passage that covers every question term
+# and names one of them in its title answers the question outright, and
+# one that covers most terms is passed to the LLM as context
+GROUNDED_CONTEXT_MIN_COVERAGE = float(os.environ.get("CHAT_GROUNDED_CONTEXT_MIN_COVERAGE", "0.5"))
+GROUNDED_CONTEXT_MAX_CHARS = 800
+tutor_answer_sources = Counter()
+
+# Shorter question words ("me", "ll", "ve") carry no topic; they are
+# neither counted for coverage nor allowed to prefix-match a title
+CHAT_QUERY_MIN_TERM_LENGTH = 3
+
+def question_terms(question: str) -> List[str]:
+    return sorted({term for term in tokenize(question) if len(term) >= CHAT_QUERY_MIN_TERM_LENGTH})
+
+def term_covered(term: str, words: List[str]) -> bool:
+    return any(word.startswith(term) for word in words)
+
+def match_lesson_passage(question: str) -> Optional[Any]:
+    """Best passage for a question as (passage, coverage, title match), if any"""
+    terms = question_terms(question)
+    if not terms:
+        return None
+    hits = lesson_passage_index.search(" ".join(terms), limit=1)
+    if not hits:
+        return None
+    key = hits[0][0]
+    passage = lesson_passages[key]
+    passage_terms = lesson_passage_index.doc_terms[key]
+    title_terms = tokenize(passage["title"])
+    coverage = sum(1 for term in terms if term_covered(term, passage_terms)) / len(terms)
+    return passage, coverage, any(term_covered(term, title_terms) for term in terms)
+
+def grounded_answer(passage: Dict[str, Any]) -> str:
+    lines = [f"{passage['title']}: {passage['text']}"]
+    lines += [f"- {point}" for point in passage["key_points"]]
+    lines.append(f"(From the lesson \"{passage['lesson_title']}\")")
+    return "\n".join(lines)
+
+def grounded_prompt(passage: Dict[str, Any], message: str) -> str:
+    excerpt = " ".join([passage["text"], *passage["key_points"]])[:GROUNDED_CONTEXT_MAX_CHARS]
+    return (
+        f"Lesson context ({passage['lesson_title']} - {passage['title']}): {excerpt}\n\n"
+        f"Student question: {message}"
+    )
+
+def local_reply(message: str, first_turn: bool) -> Any:
+    """Answer from the cache or a lesson passage as (reply, None), or (None, prompt for the LLM)"""
+    # Only opening questions are cacheable; later turns depend on the conversation so far
+    if first_turn:
+        cached = answer_cache.get(message)
+        if cached is not None:
+            tutor_answer_sources["cache"] += 1
+            return cached, None
+    match = match_lesson_passage(message)
+    if match is not None:
+        passage, coverage, title_match = match
+        if coverage == 1.0 and title_match:
+            tutor_answer_sources["lesson"] += 1
+            return grounded_answer(passage), None
+        if coverage >= GROUNDED_CONTEXT_MIN_COVERAGE:
+            tutor_answer_sources["lesson_context"] += 1
+            return None, grounded_prompt(passage, message)
+    tutor_answer_sources["llm"] += 1
+    return None, message
+
+async def tutor_reply(session_id: str, user_id: str, message: str, first_turn: bool, context: Optional[Dict[str, Any]] = None) -> str:
+    """Answer a question; the caller queues the exchange into the session context with its messages"""
+    reply, prompt = local_reply(message, first_turn)
+    if reply is None:
+        llm_breaker.check()
+        chat = await session_chat_client(session_id, first_turn, context)
+        reply = await llm_limiter.call(user_id, lambda: guarded_send(session_id, chat, prompt, first_turn))
+        if first_turn:
+            answer_cache.put(message, reply)
+    else:
+        # The pooled client never saw this turn; rebuild it from the stored context next time
+        chat_clients.discard(session_id)
+    return reply
+
+CHAT_SESSION_PREVIEW_CHARS = 200
+CHAT_HISTORY_PAGE_LIMIT = 200
+CHAT_SESSIONS_PAGE_LIMIT = 100
+CHAT_READ_FLUSH_TIMEOUT = float(os.environ.get("CHAT_READ_FLUSH_TIMEOUT_SECONDS", "2"))
+
+def transient_write_error(error: Exception) -> bool:
+    """Errors a retry can fix: lost connections, elections and timeouts"""
+    if isinstance(error, (ConnectionFailure, ExecutionTimeout, WTimeoutError)):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+class ChatTurnWriter:
+    """Bounded write-behind queue persisting chat messages with one insert_many per batch
+
+    Tutor exchanges queued with their messages are folded into the session
+    context after the batch is written, off the response path.
+    """
+
+    def __init__(self, max_pending: int, batch_size: int, retry_delay: float, max_retries: int):
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.pending_sessions = Counter()
+        self.session_drained: Dict[str, asyncio.Event] = {}
+        self.written = 0
+        self.failures = 0
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, messages: List[ChatMessage], context_turn: Optional[Dict[str, str]] = None):
+        """Queue messages of one session; context_turn is a {"user", "ai"} exchange for the tutor context"""
+        # Waits when the queue is full, so a stalled database slows chat down instead of growing memory
+        turn = [message.dict() for message in messages]
+        session_id = turn[0]["session_id"]
+        self.pending_sessions[session_id] += 1
+        self.session_drained.setdefault(session_id, asyncio.Event())
+        await self.queue.put((turn, context_turn))
+
+    def has_pending(self, session_id: str) -> bool:
+        return self.pending_sessions[session_id] > 0
+
+    async def flush(self):
+        await self.queue.join()
+
+    async def flush_session(self, session_id: str, timeout: float) -> bool:
+        """Wait until this session's queued turns are written; False on timeout"""
+        drained = self.session_drained.get(session_id)
+        if drained is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(drained.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def write(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert a batch and return the messages that are stored
+
+        Transient errors are retried up to max_retries times. Messages the
+        database rejects for good, e.g. DocumentTooLarge, are logged and
+        dropped so they cannot stall every chat queued behind them.
+        """
+        attempt = 0
+        while True:
+            try:
+                await db.chat_messages.insert_many(docs, ordered=False)
+                return docs
+            except BulkWriteError as e:
+                # Unordered: everything but the listed documents was inserted, and
+                # duplicates are messages an earlier failed attempt already wrote
+                rejected = {
+                    error["index"]: error.get("errmsg")
+                    for error in e.details.get("writeErrors", []) if error.get("code") != 11000
+                }
+                for index, reason in rejected.items():
+                    self.drop(docs[index], reason)
+                return [doc for index, doc in enumerate(docs) if index not in rejected]
+            except Exception as e:
+                if not transient_write_error(e):
+                    if len(docs) == 1:
+                        self.drop(docs[0], str(e))
+                        return []
+                    # Find the offending messages by writing the batch one message at a time
+                    logger.error(f"Chat message batch failed, writing messages one by one: {e}")
+                    stored = []
+                    for doc in docs:
+                        stored += await self.write([doc])
+                    return stored
+                self.failures += 1
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Dropping {len(docs)} chat messages after {self.max_retries} retries: {e}")
+                    for doc in docs:
+                        self.drop(doc, str(e), log=False)
+                    return []
+                logger.warning(f"Failed to write chat messages, retry {attempt}/{self.max_retries}: {e}")
+            await asyncio.sleep(min(self.retry_delay * 2 ** (attempt - 1), 30))
+
+    def drop(self, doc: Dict[str, Any], reason: Optional[str], log: bool = True):
+        self.dropped += 1
+        if log:
+            logger.error(
+                f"Dropping chat message {doc.get('id')} of session {doc.get('session_id')} "
+                f"({len(doc.get('message') or '')} chars): {reason}"
+            )
+
+    async def update_sessions(self, docs: List[Dict[str, Any]]):
+        """Fold written messages into the per-session summaries used by the session list"""
+        try:
+            counts = Counter(doc["session_id"] for doc in docs)
+            latest: Dict[str, Dict[str, Any]] = {}
+            for doc in docs:
+                current = latest.get(doc["session_id"])
+                if current is None or doc["timestamp"] >= current["timestamp"]:
+                    latest[doc["session_id"]] = doc
+            await bulk_upsert(db.chat_sessions, [
+                ({"session_id": session_id}, {
+                    "$inc": {"message_count": counts[session_id]},
+                    "$max": {"updated_at": doc["timestamp"]},
+                    "$set": {"last_message": {
+                        "sender": doc["sender"],
+                        "message": doc["message"][:CHAT_SESSION_PREVIEW_CHARS],
+                        "timestamp": doc["timestamp"]
+                    }},
+                    "$setOnInsert": {"user_id": doc["user_id"], "created_at": doc["timestamp"]}
+                })
+                for session_id, doc in latest.items()
+            ])
+        except Exception as e:
+            # The messages are stored; a missed summary update only affects the session list
+            logger.error(f"Failed to update chat session summaries: {e}")
+
+    async def update_contexts(self, batch: List[Any]):
+        """Fold the batch's tutor exchanges into each session's context, in order"""
+        turns = defaultdict(list)
+        for docs, context_turn in batch:
+            if context_turn is not None:
+                turns[(docs[0]["session_id"], docs[0]["user_id"])].append(context_turn)
+        for (session_id, user_id), session_turns in turns.items():
+            try:
+                await update_chat_context(session_id, user_id, session_turns)
+            except Exception as e:
+                # The reply was already sent; a missed update only shortens what the tutor recalls
+                logger.error(f"Failed to update chat context of session {session_id}: {e}")
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            docs = [doc for turn, _ in batch for doc in turn]
+            stored = await self.write(docs)
+            if stored:
+                await self.update_sessions(stored)
+            self.written += len(stored)
+            await self.update_contexts(batch)
+            for turn, _ in batch:
+                session_id = turn[0]["session_id"]
+                self.pending_sessions[session_id] -= 1
+                if self.pending_sessions[session_id] <= 0:
+                    del self.pending_sessions[session_id]
+                    self.session_drained.pop(session_id).set()
+                self.queue.task_done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Shutting down with {self.queue.qsize()} chat turns unwritten")
+        if self._task:
+            self._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_turns": self.queue.qsize(),
+            "written_messages": self.written,
+            "write_failures": self.failures,
+            "dropped_messages": self.dropped
+        }
+
+chat_writer = ChatTurnWriter(
+    max_pending=int(os.environ.get("CHAT_WRITE_QUEUE_SIZE", "1000")),
+    batch_size=int(os.environ.get("CHAT_WRITE_BATCH_SIZE", "100")),
+    retry_delay=float(os.environ.get("CHAT_WRITE_RETRY_SECONDS", "1")),
+    max_retries=int(os.environ.get("CHAT_WRITE_MAX_RETRIES", "5"))
+)
+
 @api_router.post("/chat/sessions")
 async def create_chat_session(chat_data: ChatSessionCreate):
     session_id = str(uuid.uuid4())
     
-    # Create LLM chat instance
-    chat = LlmChat(
-        api_key=openai_api_key,
-        session_id=session_id,
-        system_message="You are an expert biology tutor specializing in gene editing, CRISPR technology, climate adaptation, and ethical considerations in biotechnology. You help high school students understand complex genetic concepts through clear explanations, examples, and interactive discussions. You can provide quizzes, explain ethical dilemmas, and guide students through genetic engineering applications for climate change adaptation."
-    ).with_model("openai", "gpt-4o").with_max_tokens(4096)
-    
-    # Store user message
     user_message = ChatMessage(
         user_id=chat_data.user_id,
         session_id=session_id,
         message=chat_data.message,
         sender="user"
     )
-    await db.chat_messages.insert_one(user_message.dict())
     
+    context_turn = None
     try:
         # Get AI response
-        ai_response = await chat.send_message(UserMessage(text=chat_data.message))
-        
-        # Store AI message
-        ai_message = ChatMessage(
-            user_id=chat_data.user_id,
-            session_id=session_id,
-            message=ai_response,
-            sender="ai"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {
-            "session_id": session_id,
-            "user_message": user_message.dict(),
-            "ai_response": ai_message.dict()
-        }
-        
+        ai_response = await tutor_reply(session_id, chat_data.user_id, chat_data.message, first_turn=True)
+        context_turn = {"user": chat_data.message, "ai": ai_response}
+    except HTTPException:
+        # Shed load without storing the turn, so the client can retry it
+        raise
     except Exception as e:
         # If AI fails, provide a fallback response
-        fallback_response = "I'm sorry, I'm having trouble processing your question right now. Could you please try rephrasing your question about gene editing or climate adaptation?"
-        
-        ai_message = ChatMessage(
-            user_id=chat_data.user_id,
-            session_id=session_id,
-            message=fallback_response,
-            sender="ai"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {
-            "session_id": session_id,
-            "user_message": user_message.dict(),
-            "ai_response": ai_message.dict()
-        }
+        logger.exception(f"Tutor reply failed for session {session_id}: {e}")
+        ai_response = "I'm sorry, I'm having trouble processing your question right now. Could you please try rephrasing your question about gene editing or climate adaptation?"
+    
+    ai_message = ChatMessage(
+        user_id=chat_data.user_id,
+        session_id=session_id,
+        message=ai_response,
+        sender="ai"
+    )
+    await chat_writer.add([user_message, ai_message], context_turn)
+    
+    return {
+        "session_id": session_id,
+        "user_message": user_message.dict(),
+        "ai_response": ai_message.dict()
+    }
 
 @api_router.post("/chat/sessions/{session_id}/message")
 async def send_chat_message(session_id: str, user_id: str, message: str):
-    # Store user message
+    # A pooled client means the session already has turns; otherwise the
+    # stored context, needed to build one anyway, tells whether it has any
+    first_turn = False
+    context = None
+    if chat_clients.needs_context(session_id):
+        context = await current_chat_context(session_id)
+        first_turn = context is None and not chat_writer.has_pending(session_id)
+    
     user_message = ChatMessage(
         user_id=user_id,
         session_id=session_id,
         message=message,
         sender="user"
     )
-    await db.chat_messages.insert_one(user_message.dict())
     
+    context_turn = None
     try:
-        # Create LLM chat instance with existing session
-        chat = LlmChat(
-            api_key=openai_api_key,
-            session_id=session_id,
-            system_message="You are an expert biology tutor specializing in gene editing, CRISPR technology, climate adaptation, and ethical considerations in biotechnology. You help high school students understand complex genetic concepts through clear explanations, examples, and interactive discussions. You can provide quizzes, explain ethical dilemmas, and guide students through genetic engineering applications for climate change adaptation."
-        ).with_model("openai", "gpt-4o").with_max_tokens(4096)
-        
         # Get AI response
-        ai_response = await chat.send_message(UserMessage(text=message))
-        
-        # Store AI message
-        ai_message = ChatMessage(
-            user_id=user_id,
-            session_id=session_id,
-            message=ai_response,
-            sender="ai"
-        )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {
-            "user_message": user_message.dict(),
-            "ai_response": ai_message.dict()
-        }
-        
+        ai_response = await tutor_reply(session_id, user_id, message, first_turn, context)
+        context_turn = {"user": message, "ai": ai_response}
+    except HTTPException:
+        # Shed load without storing the turn, so the client can retry it
+        raise
     except Exception as e:
         # Fallback response
-        fallback_response = "I'm experiencing some technical difficulties. Let me try to help you with a general response about gene editing and climate adaptation."
-        
-        ai_message = ChatMessage(
-            user_id=user_id,
-            session_id=session_id,
-            message=fallback_response,
-            sender="ai"
+        logger.exception(f"Tutor reply failed for session {session_id}: {e}")
+        ai_response = "I'm experiencing some technical difficulties. Let me try to help you with a general response about gene editing and climate adaptation."
+    
+    ai_message = ChatMessage(
+        user_id=user_id,
+        session_id=session_id,
+        message=ai_response,
+        sender="ai"
+    )
+    await chat_writer.add([user_message, ai_message], context_turn)
+    
+    return {
+        "user_message": user_message.dict(),
+        "ai_response": ai_message.dict()
+    }
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def stream_reply(chat: Any, message: str, tokens: asyncio.Queue):
+    """Feed reply tokens into the queue, ending with None"""
+    stream = getattr(chat, "stream_message", None)
+    try:
+        # Inside the try, so an open circuit still ends the token stream
+        llm_breaker.check()
+        if stream is None:
+            # Client library without token streaming: forward the whole reply as one chunk
+            await tokens.put(await chat.send_message(UserMessage(text=message)))
+        else:
+            async for token in stream(UserMessage(text=message)):
+                await tokens.put(token)
+    finally:
+        await tokens.put(None)
+
+@api_router.post("/chat/sessions/{session_id}/stream")
+async def stream_chat_message(session_id: str, user_id: str, message: str):
+    user_message = ChatMessage(
+        user_id=user_id,
+        session_id=session_id,
+        message=message,
+        sender="user"
+    )
+    # The slot is held for the whole stream and released once it ends
+    await llm_limiter.acquire(user_id)
+    started = time.monotonic()
+    released = False
+
+    def release_slot():
+        # Called from the stream's finally and again as a background task, in
+        # case the body never ran; only the first call releases
+        nonlocal released
+        if not released:
+            released = True
+            llm_limiter.release(user_id, time.monotonic() - started)
+
+    try:
+        # Before queueing the user message, which a context load would wait on
+        chat = await session_chat_client(session_id)
+        await chat_writer.add([user_message])
+    except Exception:
+        release_slot()
+        raise
+
+    async def events():
+        yield sse_event("user_message", user_message.dict())
+        tokens: asyncio.Queue = asyncio.Queue()
+        sent = time.monotonic()
+        upstream = asyncio.create_task(
+            asyncio.wait_for(stream_reply(chat, message, tokens), llm_limiter.call_timeout)
         )
-        await db.chat_messages.insert_one(ai_message.dict())
-        
-        return {
-            "user_message": user_message.dict(),
-            "ai_response": ai_message.dict()
-        }
+        parts = []
+        try:
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                parts.append(token)
+                yield sse_event("token", {"text": token})
+            try:
+                await upstream
+                llm_breaker.record(True, time.monotonic() - sent)
+                reply = "".join(parts)
+                context_turn = {"user": message, "ai": reply}
+            except Exception as e:
+                # Provider errors and the call deadline count against the circuit; a
+                # client disconnect never gets here, since the generator is closed
+                if not isinstance(e, CircuitOpenError):
+                    llm_breaker.record(False, time.monotonic() - sent)
+                logger.exception(f"Streaming chat reply failed for session {session_id}: {e}")
+                # Keep a partial answer; otherwise fall back like send_chat_message
+                reply = "".join(parts)
+                context_turn = {"user": message, "ai": reply} if reply else None
+                if not reply:
+                    reply = "I'm experiencing some technical difficulties. Let me try to help you with a general response about gene editing and climate adaptation."
+                    yield sse_event("token", {"text": reply})
+            ai_message = ChatMessage(
+                user_id=user_id,
+                session_id=session_id,
+                message=reply,
+                sender="ai"
+            )
+            await chat_writer.add([ai_message], context_turn)
+            yield sse_event("done", ai_message.dict())
+        finally:
+            # Runs when the client disconnects mid-stream, so no further tokens are paid for
+            upstream.cancel()
+            # Starlette skips the background task when the body raises
+            release_slot()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_slot)
+    )
+
+def encode_chat_cursor(message: Dict[str, Any]) -> str:
+    raw = json.dumps([message["timestamp"].isoformat(), message["id"]])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_chat_cursor(cursor: str) -> Any:
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(timestamp), str(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @api_router.get("/chat/sessions/{session_id}/messages")
-async def get_chat_messages(session_id: str):
-    messages = await db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1).to_list(1000)
+async def get_chat_messages(session_id: str, response: Response, limit: int = 50, before: Optional[str] = None):
+    """Newest page of a session's messages in chronological order; X-Next-Cursor pages further back"""
+    # Wait for this session's own queued turns only, and not forever
+    if not await chat_writer.flush_session(session_id, CHAT_READ_FLUSH_TIMEOUT):
+        logger.warning(f"Serving chat history for session {session_id} with turns still queued")
+    limit = max(1, min(limit, CHAT_HISTORY_PAGE_LIMIT))
+    query: Dict[str, Any] = {"session_id": session_id}
+    if before:
+        timestamp, message_id = decode_chat_cursor(before)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": message_id}}
+        ]
+    # Served by the (session_id, timestamp, id) index, walking back from the newest message
+    messages = await db.chat_messages.find(query).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = encode_chat_cursor(messages[-1])
+    messages.reverse()
     return [serialize_doc(message) for message in messages]
 
+@api_router.get("/users/{user_id}/chat/sessions")
+async def get_user_chat_sessions(user_id: str, skip: int = 0, limit: int = 20):
+    limit = max(1, min(limit, CHAT_SESSIONS_PAGE_LIMIT))
+    sessions = await db.chat_sessions.find(
+        {"user_id": user_id},
+        {"_id": 0, "session_id": 1, "last_message": 1, "message_count": 1, "created_at": 1, "updated_at": 1}
+    ).sort("updated_at", -1).skip(skip).limit(limit).to_list(limit)
+    return sessions
+
 # Projects
 @api_router.get("/users/{user_id}/projects")
 async def get_user_projects(user_id: str):
@@ -872,7 +2885,9 @@ async def get_user_projects(user_id: str):
 @api_router.post("/users/{user_id}/projects", response_model=Project)
 async def create_project(user_id: str, project_data: ProjectCreate):
     project = Project(user_id=user_id, **project_data.dict())
-    await db.projects.insert_one(project.dict())
+    async with activity_writes.write():
+        await db.projects.insert_one(project.dict())
+        await record_activity(user_id, "project_created")
     return project
 
 @api_router.put("/projects/{project_id}")
@@ -890,41 +2905,645 @@ async def update_project(project_id: str, project_data: ProjectUpdate):
     
     return {"message": "Project updated successfully"}
 
+# Achievements
+@api_router.get("/achievements", response_model=List[Achievement])
+async def get_achievements():
+    achievements = await db.achievements.find().to_list(1000)
+    return [serialize_doc(achievement) for achievement in achievements]
+
+@api_router.post("/achievements", response_model=Achievement)
+async def create_achievement(achievement_data: AchievementCreate):
+    # The engine can only evaluate positive thresholds on tracked activity counters
+    counters = set(ACTIVITY_COUNTERS.values())
+    if not achievement_data.criteria:
+        raise HTTPException(status_code=400, detail="Achievement criteria must not be empty")
+    for counter, threshold in achievement_data.criteria.items():
+        if counter not in counters:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported achievement counter '{counter}', expected one of: {', '.join(sorted(counters))}"
+            )
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or threshold <= 0:
+            raise HTTPException(status_code=400, detail=f"Threshold for '{counter}' must be a positive number")
+
+    achievement = Achievement(**achievement_data.dict())
+    await db.achievements.insert_one(achievement.dict())
+    achievement_engine.load(await db.achievements.find().to_list(1000))
+    return achievement
+
+@api_router.get("/users/{user_id}/achievements")
+async def get_user_achievements(user_id: str):
+    achievements = await db.achievements.find({}, {"_id": 0}).to_list(1000)
+    unlocked = {
+        row["achievement_id"]: row
+        async for row in db.user_achievements.find({"user_id": user_id}, {"_id": 0})
+    }
+    return [
+        {
+            **achievement,
+            "unlocked": unlocked.get(achievement["id"], {}).get("unlocked", False),
+            "progress": unlocked.get(achievement["id"], {}).get("progress", 0.0),
+            "unlocked_at": unlocked.get(achievement["id"], {}).get("unlocked_at")
+        }
+        for achievement in achievements
+    ]
+
+achievement_backfill: Optional[asyncio.Task] = None
+
+@api_router.post("/achievements/backfill")
+async def start_achievement_backfill():
+    """Recount activity from the source collections and evaluate every achievement"""
+    global achievement_backfill
+    if achievement_backfill and not achievement_backfill.done():
+        return {"message": "Achievement backfill already running"}
+    achievement_backfill = asyncio.create_task(backfill_achievements())
+    return {"message": "Achievement backfill started"}
+
+# Offline sync
+SYNC_BATCH_LIMIT = 1000
+SYNC_EVENT_MODELS = {
+    "lesson_progress": SyncLessonProgress,
+    "ethical_decision": SyncEthicalDecision,
+    "project_edit": SyncProjectEdit
+}
+
+@api_router.post("/users/{user_id}/sync")
+async def sync_user_events(user_id: str, batch: SyncBatch):
+    """Apply a backlog of offline events with one bulk write per collection"""
+    if len(batch.events) > SYNC_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_BATCH_LIMIT} events per sync")
+
+    rejected = []
+    parsed = {event_type: [] for event_type in SYNC_EVENT_MODELS}
+    seen = set()
+    for event in sorted(batch.events, key=lambda e: e.timestamp):
+        if event.event_id in seen:
+            continue
+        seen.add(event.event_id)
+        model = SYNC_EVENT_MODELS.get(event.type)
+        if model is None:
+            rejected.append({"event_id": event.event_id, "reason": f"Unknown event type: {event.type}"})
+            continue
+        try:
+            parsed[event.type].append((event, model(**event.data)))
+        except ValidationError as e:
+            rejected.append({"event_id": event.event_id, "reason": str(e)})
+
+    # Progress only ever moves forward ($max), so replays are harmless
+    progress_entries: Dict[Any, int] = {}
+    completed_times: Dict[Any, datetime] = {}
+    for event, data in parsed["lesson_progress"]:
+        key = (user_id, data.lesson_id)
+        progress_entries[key] = max(data.progress, progress_entries.get(key, data.progress))
+        if data.progress >= 100:
+            # Events are in time order, so this keeps the first offline completion
+            completed_times.setdefault(key, event.timestamp)
+    await apply_lesson_progress(progress_entries, completed_times)
+
+    # Decisions use the event id as their id and are only ever inserted
+    decisions_recorded = 0
+    if parsed["ethical_decision"]:
+        async with activity_writes.write():
+            result = await db.user_ethical_decisions.bulk_write([
+                UpdateOne(
+                    {"id": event.event_id},
+                    {"$setOnInsert": UserEthicalDecision(
+                        id=event.event_id,
+                        user_id=user_id,
+                        created_at=event.timestamp,
+                        **data.dict()
+                    ).dict()},
+                    upsert=True
+                )
+                for event, data in parsed["ethical_decision"]
+            ], ordered=False)
+            decisions_recorded = result.upserted_count
+            if decisions_recorded:
+                await record_activity(user_id, "ethical_decision", count=decisions_recorded)
+
+    # Project edits are last-writer-wins on the client timestamp; edits to
+    # the same project are folded into one update carrying the latest timestamp
+    project_edits: Dict[str, Dict[str, Any]] = {}
+    for event, data in parsed["project_edit"]:
+        fields = {k: v for k, v in data.dict(exclude={"project_id"}).items() if v is not None}
+        project_edits.setdefault(data.project_id, {}).update(fields, updated_at=event.timestamp)
+    projects_updated = 0
+    if project_edits:
+        result = await db.projects.bulk_write([
+            UpdateOne(
+                {"id": project_id, "user_id": user_id, "updated_at": {"$lt": fields["updated_at"]}},
+                {"$set": fields}
+            )
+            for project_id, fields in project_edits.items()
+        ], ordered=False)
+        projects_updated = result.modified_count
+
+    return {
+        "received": len(batch.events),
+        "lesson_progress": len(progress_entries),
+        "ethical_decisions": decisions_recorded,
+        "projects_updated": projects_updated,
+        "rejected": rejected
+    }
+
 # Analytics
+ANALYTICS_PAGE_LIMIT = 100
+
+# Only the fields the Analytics page shows
+ANALYTICS_DETAILS = {
+    "lesson_progress": (db.user_lesson_progress, {"_id": 0, "lesson_id": 1, "progress": 1, "completed": 1, "completed_at": 1, "updated_at": 1}),
+    "simulations": (db.user_simulations, {"_id": 0, "id": 1, "simulation_id": 1, "status": 1, "survival_rate": 1, "adaptation_success": 1, "created_at": 1}),
+    "decisions": (db.user_ethical_decisions, {"_id": 0, "scenario_id": 1, "selected_option": 1, "created_at": 1}),
+    "projects": (db.projects, {"_id": 0, "id": 1, "title": 1, "type": 1, "status": 1, "updated_at": 1})
+}
+
 @api_router.get("/users/{user_id}/analytics")
-async def get_user_analytics(user_id: str):
-    # Get lesson progress
-    lesson_progress = await db.user_lesson_progress.find({"user_id": user_id}).to_list(1000)
-    completed_lessons = len([p for p in lesson_progress if p.get('completed')])
-    
-    # Get simulations
-    user_simulations = await db.user_simulations.find({"user_id": user_id}).to_list(1000)
-    
-    # Get ethical decisions
-    ethical_decisions = await db.user_ethical_decisions.find({"user_id": user_id}).to_list(1000)
-    
-    # Get projects
-    user_projects = await db.projects.find({"user_id": user_id}).to_list(1000)
-    
+async def get_user_analytics(user_id: str, include_details: bool = False, skip: int = 0, limit: int = 20):
+    query = {"user_id": user_id}
+    reads = [db.user_stats.find_one(query, {"_id": 0})]
+    if include_details:
+        limit = max(1, min(limit, ANALYTICS_PAGE_LIMIT))
+        reads += [
+            collection.find(query, projection).sort("_id", -1).skip(skip).limit(limit).to_list(limit)
+            for collection, projection in ANALYTICS_DETAILS.values()
+        ]
+
+    results = await asyncio.gather(*reads)
+    stats = results[0] or {}
+    completed_simulations = stats.get("simulations_completed", 0)
+    analytics = {
+        "completed_lessons": stats.get("lessons_completed", 0),
+        "total_simulations": stats.get("simulations", 0),
+        "completed_simulations": completed_simulations,
+        "ethical_decisions": stats.get("ethical_decisions", 0),
+        "projects_created": stats.get("projects_created", 0),
+        "average_survival_rate": round(stats.get("survival_rate_total", 0) / completed_simulations, 1) if completed_simulations else 0.0
+    }
+    if include_details:
+        analytics.update(zip(ANALYTICS_DETAILS, results[1:]))
+        analytics.update(skip=skip, limit=limit)
+    return analytics
+
+user_stats_rebuild: Optional[asyncio.Task] = None
+
+@api_router.post("/analytics/user-stats/rebuild")
+async def start_user_stats_rebuild():
+    """Reconcile user_stats with the source collections; activity writes wait until it finishes"""
+    global user_stats_rebuild
+    if user_stats_rebuild and not user_stats_rebuild.done():
+        return {"message": "User stats rebuild already running"}
+    user_stats_rebuild = asyncio.create_task(rebuild_user_stats())
+    return {"message": "User stats rebuild started"}
+
+# Cohort analytics: daily rollups per (day, school, grade), recomputed only for days with new activity
+COHORT_ROLLUP_INTERVAL = int(os.environ.get("COHORT_ROLLUP_INTERVAL_SECONDS", "300"))
+COHORT_COUNTERS = [
+    "lesson_activity", "lessons_completed", "simulations", "simulations_completed",
+    "survival_rate_total", "ethical_decisions"
+]
+
+def day_of(field: str):
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+
+# (collection, timestamp field, field that changes on every write, filter,
+# counters contributed by each matching document). Insert-only collections use
+# _id, since synced rows carry the client's timestamp rather than the write time.
+# Every source is keyed on a time that never moves once written: lesson activity
+# comes from the append-only activity_events, not the progress row's updated_at,
+# which a later write would move off the day being recomputed
+COHORT_SOURCES = [
+    (db.activity_events, "ts", "ts", {"meta.kind": "lesson_progress"}, {"lesson_activity": "$count"}),
+    (db.user_lesson_progress, "completed_at", "updated_at", {}, {"lessons_completed": 1}),
+    (db.user_simulations, "created_at", "_id", {}, {
+        "simulations": 1,
+        "simulations_completed": completed_simulation(1),
+        "survival_rate_total": completed_simulation("$survival_rate")
+    }),
+    (db.user_ethical_decisions, "created_at", "_id", {}, {"ethical_decisions": 1})
+]
+# Writes stamped before a run's start can land after its scan; rescanning
+# this far behind the watermark picks them up on the next run
+COHORT_WATERMARK_MARGIN = timedelta(minutes=5)
+
+def cohort_events_expired(start: datetime) -> bool:
+    """Whether activity_events of the day starting at start may already be gone"""
+    return start < datetime.utcnow() - timedelta(days=ACTIVITY_EVENT_RETENTION_DAYS - 1)
+
+def cohort_rollup_pipeline(start: datetime, end: datetime, run_id: str):
+    """The collection to aggregate and a pipeline merging one day's rollups"""
+    expired = cohort_events_expired(start)
+    branches = []
+    for collection, field, _, match, counters in COHORT_SOURCES:
+        if expired and collection.name == "activity_events":
+            continue
+        branches.append((collection, [
+            {"$match": {field: {"$gte": start, "$lt": end}, **match}},
+            {"$project": {
+                "_id": 0,
+                "user_id": {"$ifNull": ["$user_id", "$meta.user_id"]},
+                "day": day_of(f"${field}"),
+                **{counter: {"$literal": value} if isinstance(value, int) else value for counter, value in counters.items()}
+            }}
+        ]))
+
+    (source, pipeline), others = branches[0], branches[1:]
+    for collection, branch in others:
+        pipeline.append({"$unionWith": {"coll": collection.name, "pipeline": branch}})
+    return source, pipeline + [
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "id",
+            "as": "user"
+        }},
+        {"$unwind": "$user"},
+        {"$group": {
+            "_id": {"day": "$day", "school": "$user.school", "grade": "$user.grade"},
+            **{counter: {"$sum": {"$ifNull": [f"${counter}", 0]}} for counter in COHORT_COUNTERS},
+            "students": {"$addToSet": "$user_id"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "school": "$_id.school",
+            "grade": "$_id.grade",
+            **{counter: 1 for counter in COHORT_COUNTERS},
+            "active_students": {"$size": "$students"},
+            "rollup_run": {"$literal": run_id}
+        }},
+        {"$merge": {
+            "into": "cohort_daily_rollups",
+            "on": ["day", "school", "grade"],
+            # Past the event retention the day's lesson activity can no longer
+            # be recounted, so the stored counts are kept
+            "whenMatched": [{"$replaceWith": {"$mergeObjects": [
+                "$$new",
+                {
+                    "lesson_activity": {"$ifNull": ["$lesson_activity", 0]},
+                    "active_students": {"$max": ["$active_students", "$$new.active_students"]}
+                }
+            ]}}] if expired else "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+async def rollup_cohorts():
+    """Recompute the daily rollups of every day that saw activity since the last run"""
+    state = await db.rollup_state.find_one({"_id": "cohort_daily"}) or {}
+    watermark = state.get("watermark", datetime(1970, 1, 1))
+    started = datetime.utcnow()
+
+    cutoff = watermark - COHORT_WATERMARK_MARGIN
+    run_id = str(uuid.uuid4())
+
+    # Days are dirty by the activity time of rows written since the cutoff,
+    # so back-dated offline activity recomputes the day it happened
+    dirty_days = set()
+    for collection, field, changed, match, _ in COHORT_SOURCES:
+        since = ObjectId.from_datetime(cutoff) if changed == "_id" else cutoff
+        pipeline = [
+            {"$match": {changed: {"$gte": since}, field: {"$ne": None}, **match}},
+            {"$group": {"_id": day_of(f"${field}")}}
+        ]
+        async for row in collection.aggregate(pipeline):
+            dirty_days.add(row["_id"])
+
+    for day in sorted(dirty_days):
+        start = datetime.strptime(day, "%Y-%m-%d")
+        collection, pipeline = cohort_rollup_pipeline(start, start + timedelta(days=1), run_id)
+        # The pipeline ends in $merge, so iterating just runs it
+        async for _ in collection.aggregate(pipeline):
+            pass
+        # Groups this run no longer produced, e.g. after a user moved school or
+        # grade; past the event retention a group may hold only lesson activity
+        if not cohort_events_expired(start):
+            await db.cohort_daily_rollups.delete_many({"day": day, "rollup_run": {"$ne": run_id}})
+
+    # Activity written while the rollup ran is picked up next time, within the margin
+    await db.rollup_state.update_one({"_id": "cohort_daily"}, {"$set": {"watermark": started}}, upsert=True)
+    if dirty_days:
+        logger.info(f"Cohort rollups recomputed for {len(dirty_days)} days")
+
+def cohort_totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    totals = {counter: sum(row.get(counter, 0) for row in rows) for counter in COHORT_COUNTERS}
+    survival_rate_total = totals.pop("survival_rate_total")
+    completed = totals["simulations_completed"]
+    totals["average_survival_rate"] = round(survival_rate_total / completed, 1) if completed else 0.0
+    totals["active_student_days"] = sum(row.get("active_students", 0) for row in rows)
+    return totals
+
+def cohort_day_range(start: Optional[str], end: Optional[str]):
+    try:
+        end_day = datetime.strptime(end, "%Y-%m-%d").date() if end else datetime.utcnow().date()
+        start_day = datetime.strptime(start, "%Y-%m-%d").date() if start else end_day - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates in YYYY-MM-DD format")
+    return start_day.isoformat(), end_day.isoformat()
+
+@api_router.get("/analytics/schools/{school}")
+async def get_school_analytics(school: str, start: Optional[str] = None, end: Optional[str] = None):
+    """Daily activity of a school between start and end (YYYY-MM-DD, default last 30 days)"""
+    start, end = cohort_day_range(start, end)
+    rows = await db.cohort_daily_rollups.find(
+        {"school": school, "day": {"$gte": start, "$lte": end}}, {"_id": 0}
+    ).to_list(None)
+
+    by_day = defaultdict(list)
+    for row in rows:
+        by_day[row["day"]].append(row)
+    return {
+        "school": school,
+        "start": start,
+        "end": end,
+        "totals": cohort_totals(rows),
+        "days": [{"day": day, **cohort_totals(day_rows)} for day, day_rows in sorted(by_day.items())]
+    }
+
+@api_router.get("/analytics/schools/{school}/grades")
+async def get_school_grade_analytics(school: str, start: Optional[str] = None, end: Optional[str] = None):
+    start, end = cohort_day_range(start, end)
+    rows = await db.cohort_daily_rollups.find(
+        {"school": school, "day": {"$gte": start, "$lte": end}}, {"_id": 0}
+    ).to_list(None)
+
+    by_grade = defaultdict(list)
+    for row in rows:
+        by_grade[row["grade"]].append(row)
     return {
-        "completed_lessons": completed_lessons,
-        "total_simulations": len(user_simulations),
-        "ethical_decisions": len(ethical_decisions),
-        "projects_created": len(user_projects),
-        "lesson_progress": [serialize_doc(p) for p in lesson_progress],
-        "simulations": [serialize_doc(s) for s in user_simulations],
-        "ethical_decisions": [serialize_doc(d) for d in ethical_decisions],
-        "projects": [serialize_doc(p) for p in user_projects]
+        "school": school,
+        "start": start,
+        "end": end,
+        "grades": [{"grade": grade, **cohort_totals(grade_rows)} for grade, grade_rows in sorted(by_grade.items())]
     }
 
+# Activity metrics: hourly and daily buckets compacted from activity_events
+ACTIVITY_ROLLUP_INTERVAL = int(os.environ.get("ACTIVITY_ROLLUP_INTERVAL_SECONDS", "60"))
+ACTIVITY_GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+ACTIVITY_METRICS = {
+    "lesson_progress_events": ["lesson_progress"],
+    "lesson_completions": ["lesson_completed"],
+    "simulation_runs": ["simulation_started", "simulation_completed"],
+    "ethical_decisions": ["ethical_decision"],
+    "projects_created": ["project_created"]
+}
+
+def truncate_time(value: datetime, granularity: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if granularity == "day" else value
+
+def truncate_expression(field: str, granularity: str) -> Dict[str, Any]:
+    # $dateFromParts rather than $dateTrunc, which needs MongoDB 5.0; servers
+    # without time-series collections fall back to a plain activity_events
+    parts = {"year": {"$year": field}, "month": {"$month": field}, "day": {"$dayOfMonth": field}}
+    if granularity == "hour":
+        parts["hour"] = {"$hour": field}
+    return {"$dateFromParts": parts}
+
+async def rollup_activity():
+    """Recompute the buckets that can have changed since the last run"""
+    state = await db.rollup_state.find_one({"_id": "activity_buckets"}) or {}
+    watermark = state.get("watermark", datetime(1970, 1, 1))
+    started = datetime.utcnow()
+    # Events are stamped before they are inserted, so one stamped just before
+    # the last run started can land after its scan; recompute from the margin
+    cutoff = watermark - COHORT_WATERMARK_MARGIN
+
+    for granularity in ACTIVITY_GRANULARITIES:
+        pipeline = [
+            {"$match": {"ts": {"$gte": truncate_time(cutoff, granularity)}}},
+            {"$group": {
+                "_id": truncate_expression("$ts", granularity),
+                "users": {"$addToSet": "$meta.user_id"},
+                "events": {"$sum": "$count"},
+                **{
+                    metric: {"$sum": {"$cond": [{"$in": ["$meta.kind", kinds]}, "$count", 0]}}
+                    for metric, kinds in ACTIVITY_METRICS.items()
+                }
+            }},
+            {"$project": {
+                "_id": 0,
+                "granularity": {"$literal": granularity},
+                "bucket": "$_id",
+                "active_users": {"$size": "$users"},
+                "events": 1,
+                **{metric: 1 for metric in ACTIVITY_METRICS}
+            }},
+            {"$merge": {
+                "into": "activity_buckets",
+                "on": ["granularity", "bucket"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]
+        async for _ in db.activity_events.aggregate(pipeline):
+            pass
+
+    await db.rollup_state.update_one({"_id": "activity_buckets"}, {"$set": {"watermark": started}}, upsert=True)
+
+@api_router.get("/analytics/activity")
+async def get_activity_metrics(
+    granularity: str = "day",
+    metric: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Activity series over time, e.g. daily active users or hourly simulation runs"""
+    if granularity not in ACTIVITY_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {list(ACTIVITY_GRANULARITIES)}")
+    metrics = ["active_users", "events", *ACTIVITY_METRICS]
+    if metric is not None and metric not in metrics:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {metrics}")
+
+    end = end or datetime.utcnow()
+    start = start or end - ACTIVITY_GRANULARITIES[granularity] * (48 if granularity == "hour" else 30)
+    projection = {"_id": 0, "bucket": 1, **{name: 1 for name in ([metric] if metric else metrics)}}
+    buckets = await db.activity_buckets.find(
+        {"granularity": granularity, "bucket": {"$gte": truncate_time(start, granularity), "$lte": end}},
+        projection
+    ).sort("bucket", 1).to_list(None)
+    return {"granularity": granularity, "start": start, "end": end, "series": buckets}
+
+# Research exports, streamed from the cursor in bounded batches
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MAX_BATCH_SIZE = 5000
+
+# collection name -> (collection, date field used by start/end, [(column, type)])
+EXPORTS = {
+    "lesson_progress": (db.user_lesson_progress, "updated_at", [
+        ("id", "string"), ("user_id", "string"), ("lesson_id", "string"), ("progress", "int"),
+        ("completed", "bool"), ("sections_completed", "int"), ("started_at", "timestamp"),
+        ("completed_at", "timestamp"), ("updated_at", "timestamp")
+    ]),
+    "simulations": (db.user_simulations, "created_at", [
+        ("id", "string"), ("user_id", "string"), ("simulation_id", "string"), ("status", "string"),
+        ("current_level", "int"), ("survival_rate", "float"), ("yield_increase", "float"),
+        ("adaptation_success", "bool"), ("resistance_level", "float"), ("population_health", "float"),
+        ("environmental_impact", "float"), ("created_at", "timestamp"), ("updated_at", "timestamp")
+    ]),
+    "decisions": (db.user_ethical_decisions, "created_at", [
+        ("id", "string"), ("user_id", "string"), ("scenario_id", "string"),
+        ("selected_option", "string"), ("reasoning", "string"), ("created_at", "timestamp")
+    ])
+}
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+async def export_batches(collection, query: Dict[str, Any], columns: List[str], batch_size: int):
+    cursor = collection.find(query, {"_id": 0, **{column: 1 for column in columns}}, batch_size=batch_size)
+    batch = []
+    async for row in cursor:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_csv(batches, columns: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for batch in batches:
+        writer.writerows([[export_value(row.get(column)) for column in columns] for row in batch])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def stream_ndjson(batches, columns: List[str]):
+    async for batch in batches:
+        yield "".join(
+            json.dumps({column: export_value(row.get(column)) for column in columns}) + "\n"
+            for row in batch
+        )
+
+class ChunkSink:
+    """Write-only file that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def parquet_type(kind: str):
+    return {
+        "string": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("ms")
+    }[kind]
+
+async def stream_parquet(batches, schema_columns: List[Any]):
+    schema = pa.schema([(column, parquet_type(kind)) for column, kind in schema_columns])
+    columns = [column for column, _ in schema_columns]
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        # One row group per cursor batch
+        async for batch in batches:
+            frame = pd.DataFrame.from_records(batch, columns=columns)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False, safe=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+@api_router.get("/exports/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = "csv",
+    school: Optional[str] = None,
+    grade: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+):
+    """Stream a research export as CSV, newline-delimited JSON or Parquet"""
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {collection}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(EXPORT_FORMATS)}")
+    if format == "parquet" and pa is None:
+        raise HTTPException(status_code=400, detail="Parquet exports require pyarrow to be installed")
+
+    source, date_field, schema_columns = EXPORTS[collection]
+    columns = [column for column, _ in schema_columns]
+    query: Dict[str, Any] = {}
+    if user_id:
+        query["user_id"] = user_id
+    user_filter = {k: v for k, v in {"school": school, "grade": grade}.items() if v is not None}
+    if user_filter:
+        user_ids = await db.users.distinct("id", user_filter)
+        query["user_id"] = {"$in": [user_id] if user_id in user_ids else []} if user_id else {"$in": user_ids}
+    if start or end:
+        query[date_field] = {k: v for k, v in {"$gte": start, "$lt": end}.items() if v is not None}
+
+    batches = export_batches(source, query, columns, max(1, min(batch_size, EXPORT_MAX_BATCH_SIZE)))
+    if format == "csv":
+        body = stream_csv(batches, columns)
+    elif format == "ndjson":
+        body = stream_ndjson(batches, columns)
+    else:
+        body = stream_parquet(batches, schema_columns)
+
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{collection}.{format}"'}
+    )
+
 # Basic health check
 @api_router.get("/")
 async def root():
     return {"message": "GeneAdapt API is running", "version": "1.0"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        "llm_backend": llm_backend.name,
+        "chat_answer_cache": answer_cache.stats(),
+        "chat_answer_sources": dict(tutor_answer_sources),
+        "llm_limiter": llm_limiter.stats(),
+        "llm_circuit": llm_breaker.status(),
+        "llm_hedges": dict(hedge_counts),
+        "chat_writer": chat_writer.stats()
+    }
+
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    return {"status": "healthy", "timestamp": datetime.utcnow(), "llm_circuit": llm_breaker.status()}
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -944,8 +3563,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks: List[asyncio.Task] = []
+
+async def run_periodically(interval: float, job, name: str):
+    while True:
+        try:
+            await job()
+        except Exception:
+            logger.exception(f"{name} failed")
+        await asyncio.sleep(interval)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await progress_buffer.close()
+    await chat_writer.close(timeout=float(os.environ.get("CHAT_WRITE_SHUTDOWN_TIMEOUT_SECONDS", "30")))
     client.close()
 
 # Initialize sample data
@@ -2289,4 +4922,114 @@ async def initialize_sample_data():
         ]
         await db.ethical_scenarios.insert_many(sample_scenarios)
         
-        logger.info("Sample data initialized successfully")
\ No newline at end of file
+        logger.info("Sample data initialized successfully")
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if "activity_events" not in await db.list_collection_names():
+        try:
+            await db.create_collection(
+                "activity_events",
+                timeseries={"timeField": "ts", "metaField": "meta", "granularity": "minutes"},
+                expireAfterSeconds=ACTIVITY_EVENT_RETENTION_DAYS * 86400
+            )
+        except OperationFailure:
+            # Servers without time-series support get a plain collection with a TTL index
+            await db.activity_events.create_index("ts", expireAfterSeconds=ACTIVITY_EVENT_RETENTION_DAYS * 86400)
+    await db.activity_buckets.create_index([("granularity", 1), ("bucket", 1)], unique=True)
+    await db.users.create_index("id", unique=True)
+    await db.user_stats.create_index("user_id", unique=True)
+    await db.achievements.create_index("id", unique=True)
+    await db.user_achievements.create_index([("user_id", 1), ("achievement_id", 1)], unique=True)
+    # The completion upsert relies on this index to never insert a second
+    # completed row, so startup fails if it cannot be built
+    await merge_duplicate_lesson_progress()
+    await db.user_lesson_progress.create_index([("user_id", 1), ("lesson_id", 1)], unique=True)
+    await db.user_ethical_decisions.create_index("id", unique=True)
+    await db.user_ethical_decisions.create_index("user_id")
+    await db.user_simulations.create_index("user_id")
+    await db.user_simulations.create_index("created_at")
+    await db.user_lesson_progress.create_index("updated_at")
+    await db.user_lesson_progress.create_index("completed_at")
+    await db.user_ethical_decisions.create_index("created_at")
+    await db.users.create_index([("school", 1), ("grade", 1)])
+    await db.cohort_daily_rollups.create_index([("day", 1), ("school", 1), ("grade", 1)], unique=True)
+    await db.cohort_daily_rollups.create_index([("school", 1), ("day", 1)])
+    await db.projects.create_index("user_id")
+    await db.quiz_attempts.create_index("id", unique=True)
+    await db.quiz_question_stats.create_index([("lesson_id", 1), ("question", 1)], unique=True)
+    await db.chat_sessions.create_index("session_id", unique=True)
+    await db.chat_messages.create_index("id", unique=True)
+    await db.chat_messages.create_index([("session_id", 1), ("timestamp", 1), ("id", 1)])
+    await db.chat_sessions.create_index([("user_id", 1), ("updated_at", -1)])
+
+@app.on_event("startup")
+async def warm_lesson_caches():
+    # Seeded lessons predate versioning; give them the version the Lesson model assumes
+    await db.lessons.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    async for lesson in db.lessons.find():
+        try:
+            refresh_lesson(lesson)
+        except Exception:
+            # A malformed stored lesson must not keep the app from starting
+            logger.exception(f"Failed to cache lesson {lesson.get('id')}")
+    logger.info(f"Lesson caches warmed for {len(lesson_cache)} lessons")
+
+@app.on_event("startup")
+async def load_achievements():
+    if await db.achievements.count_documents({}) == 0:
+        await db.achievements.insert_many([
+            Achievement(**achievement).dict() for achievement in DEFAULT_ACHIEVEMENTS
+        ])
+    achievement_engine.load(await db.achievements.find().to_list(1000))
+
+@app.on_event("startup")
+async def initialize_user_stats():
+    # First start with materialized stats: build them from existing activity
+    global user_stats_rebuild
+    if await db.user_stats.estimated_document_count() == 0:
+        user_stats_rebuild = asyncio.create_task(rebuild_user_stats())
+
+@app.on_event("startup")
+async def initialize_chat_sessions():
+    # Session summaries predate message_count: build them once from stored messages
+    if await db.chat_sessions.count_documents({"message_count": {"$exists": True}}, limit=1):
+        return
+    if not await db.chat_messages.count_documents({}, limit=1):
+        return
+    pipeline = [
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$session_id",
+            "user_id": {"$first": "$user_id"},
+            "message_count": {"$sum": 1},
+            "created_at": {"$min": "$timestamp"},
+            "updated_at": {"$max": "$timestamp"},
+            "last_message": {"$last": {
+                "sender": "$sender",
+                "message": {"$substrCP": ["$message", 0, CHAT_SESSION_PREVIEW_CHARS]},
+                "timestamp": "$timestamp"
+            }}
+        }},
+        {"$project": {
+            "_id": 0, "session_id": "$_id", "user_id": 1, "message_count": 1,
+            "created_at": 1, "updated_at": 1, "last_message": 1
+        }},
+        {"$merge": {"into": "chat_sessions", "on": "session_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ]
+    await db.chat_messages.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    logger.info("Chat session summaries built from chat_messages")
+
+@app.on_event("startup")
+async def start_write_buffers():
+    progress_buffer.start()
+    chat_writer.start()
+
+@app.on_event("startup")
+async def start_rollups():
+    background_tasks.append(asyncio.create_task(
+        run_periodically(COHORT_ROLLUP_INTERVAL, rollup_cohorts, "Cohort rollup")
+    ))
+    background_tasks.append(asyncio.create_task(
+        run_periodically(ACTIVITY_ROLLUP_INTERVAL, rollup_activity, "Activity rollup")
+    ))
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import requests
 import json
+import csv
+import io
 import time
 import uuid
 import os
+import sys
+import asyncio
+import base64
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -164,7 +170,132 @@ def test_lesson_management(user_id):
                 lesson_response.status_code == 200 and lesson_response.json()["id"] == lesson_id,
                 response=lesson_response
             )
-            
+
+            # Precompressed bodies are picked from Accept-Encoding; brotli is optional on the server
+            gzip_response = requests.get(f"{API_URL}/lessons/{lesson_id}", headers={"Accept-Encoding": "gzip"})
+            log_test(
+                "Get Lesson (gzip)",
+                gzip_response.status_code == 200 and
+                gzip_response.headers.get("Content-Encoding") == "gzip" and
+                gzip_response.json()["id"] == lesson_id,
+                f"Content-Encoding: {gzip_response.headers.get('Content-Encoding')}"
+            )
+
+            br_response = requests.get(
+                f"{API_URL}/lessons/{lesson_id}",
+                headers={"Accept-Encoding": "br, gzip"},
+                stream=True
+            )
+            log_test(
+                "Get Lesson (brotli negotiation)",
+                br_response.status_code == 200 and
+                br_response.headers.get("Content-Encoding") in ("br", "gzip") and
+                "Accept-Encoding" in br_response.headers.get("Vary", ""),
+                f"Content-Encoding: {br_response.headers.get('Content-Encoding')}"
+            )
+            br_response.close()
+
+            identity_response = requests.get(f"{API_URL}/lessons/{lesson_id}", headers={"Accept-Encoding": "identity"})
+            log_test(
+                "Get Lesson (uncompressed)",
+                identity_response.status_code == 200 and
+                "Content-Encoding" not in identity_response.headers and
+                identity_response.json()["id"] == lesson_id,
+                f"Content-Encoding: {identity_response.headers.get('Content-Encoding')}"
+            )
+
+            # Get lesson outline, first section and quiz slices
+            outline_response = requests.get(f"{API_URL}/lessons/{lesson_id}/outline")
+            log_test(
+                "Get Lesson Outline",
+                outline_response.status_code == 200 and "sections" in outline_response.json(),
+                response=outline_response
+            )
+
+            if outline_response.status_code == 200 and outline_response.json()["sections"]:
+                section_id = outline_response.json()["sections"][0]["id"]
+                section_response = requests.get(f"{API_URL}/lessons/{lesson_id}/sections/{section_id}")
+                etag = section_response.headers.get("ETag")
+                log_test(
+                    "Get Lesson Section",
+                    section_response.status_code == 200 and etag is not None,
+                    response=section_response
+                )
+
+                cached_response = requests.get(
+                    f"{API_URL}/lessons/{lesson_id}/sections/{section_id}",
+                    headers={"If-None-Match": etag or ""}
+                )
+                log_test(
+                    "Get Lesson Section (Not Modified)",
+                    cached_response.status_code == 304,
+                    f"Status Code: {cached_response.status_code}"
+                )
+
+            search_response = requests.get(f"{API_URL}/lessons/search", params={"q": "crispr"})
+            log_test(
+                "Search Lessons",
+                search_response.status_code == 200 and isinstance(search_response.json(), list),
+                response=search_response
+            )
+
+            quiz_response = requests.get(f"{API_URL}/lessons/{lesson_id}/quiz")
+            log_test(
+                "Get Lesson Quiz",
+                quiz_response.status_code == 200 and isinstance(quiz_response.json(), list),
+                response=quiz_response
+            )
+
+            if user_id and quiz_response.status_code == 200 and quiz_response.json():
+                questions = quiz_response.json()
+                lesson_quiz = (lesson_response.json().get("content") or {}).get("quiz") or []
+                log_test(
+                    "Quiz Hides Answers",
+                    all("correct" not in question and "explanation" not in question for question in questions + lesson_quiz),
+                    f"Lesson payload questions: {len(lesson_quiz)}"
+                )
+
+                # Grade one attempt, then re-upload it: the attempt id makes the second upload a duplicate
+                attempt = {"id": str(uuid.uuid4()), "user_id": user_id, "answers": [0] * len(questions)}
+                attempt_response = requests.post(
+                    f"{API_URL}/lessons/{lesson_id}/quiz/attempts",
+                    json={"attempts": [attempt]}
+                )
+                attempt_result = attempt_response.json() if attempt_response.status_code == 200 else {}
+                result = (attempt_result.get("results") or [{}])[0]
+                log_test(
+                    "Grade Quiz Attempt",
+                    attempt_response.status_code == 200 and
+                    attempt_result.get("recorded") == 1 and
+                    result.get("total") == len(questions) and
+                    len(result.get("correct", [])) == len(questions) and
+                    result.get("score") == sum(result.get("correct", [])) and
+                    "answer_key" not in attempt_result and "explanations" not in attempt_result,
+                    response=attempt_response
+                )
+
+                replay_response = requests.post(
+                    f"{API_URL}/lessons/{lesson_id}/quiz/attempts",
+                    json={"attempts": [attempt]}
+                )
+                log_test(
+                    "Grade Quiz Attempt (Duplicate)",
+                    replay_response.status_code == 200 and
+                    replay_response.json()["recorded"] == 0 and
+                    replay_response.json()["duplicates"] == 1,
+                    response=replay_response
+                )
+
+                mismatch_response = requests.post(
+                    f"{API_URL}/lessons/{lesson_id}/quiz/attempts",
+                    json={"attempts": [{"user_id": user_id, "answers": [0] * (len(questions) + 1)}]}
+                )
+                log_test(
+                    "Grade Quiz Attempt (Wrong Answer Count)",
+                    mismatch_response.status_code == 400,
+                    f"Status Code: {mismatch_response.status_code}"
+                )
+
             if user_id:
                 # Update lesson progress
                 progress_data = {"progress": 75}
@@ -178,14 +309,44 @@ def test_lesson_management(user_id):
                     response=progress_response
                 )
                 
-                # Get user lesson progress
+                # Get user lesson progress; buffered progress is flushed for the reading user
                 user_progress_response = requests.get(f"{API_URL}/users/{user_id}/lessons/progress")
                 log_test(
                     "Get User Lesson Progress", 
-                    user_progress_response.status_code == 200,
+                    user_progress_response.status_code == 200 and any(
+                        row["lesson_id"] == lesson_id and row["progress"] == 75
+                        for row in user_progress_response.json()
+                    ),
                     response=user_progress_response
                 )
             
+            # Lessons the cache and grader cannot use are rejected before they are stored
+            malformed_contents = [
+                {"sections": [], "quiz": [{"question": "Which?", "options": ["A", "B"], "correct": "B"}]},
+                {"sections": [], "quiz": [{"question": "Which?", "options": ["A", "B"], "correct": 2}]},
+                {"sections": [], "quiz": [{"question": "Which?", "options": ["A", "B"]}]},
+                {"sections": ["Introduction"], "quiz": []},
+                {"sections": [{"id": 1}, {"id": "1"}], "quiz": []}
+            ]
+            title = f"Malformed Lesson {uuid.uuid4().hex[:8]}"
+            statuses = [
+                requests.post(f"{API_URL}/lessons", json={
+                    "title": title,
+                    "description": "Rejected by validation",
+                    "duration": "5 min",
+                    "difficulty": "Beginner",
+                    "topics": [],
+                    "content": content
+                }).status_code
+                for content in malformed_contents
+            ]
+            stored = [l for l in requests.get(f"{API_URL}/lessons", params={"limit": 1000}).json() if l["title"] == title]
+            log_test(
+                "Reject Malformed Lesson Content",
+                statuses == [400] * len(malformed_contents) and not stored,
+                f"Status Codes: {statuses}, stored: {len(stored)}"
+            )
+
             return lesson_id
     except Exception as e:
         log_test("Lesson Management", False, f"Exception: {str(e)}")
@@ -342,14 +503,50 @@ def test_chatgpt_integration(user_id):
             
             log_test("Chat Conversation Continuity", follow_up_success, response=follow_up_response)
             
-            # Get chat history
+            # Get chat history; both turns are visible even though they are written behind
             history_response = requests.get(f"{API_URL}/chat/sessions/{session_id}/messages")
             log_test(
                 "Get Chat History", 
-                history_response.status_code == 200 and isinstance(history_response.json(), list),
+                history_response.status_code == 200 and
+                sorted(message["sender"] for message in history_response.json()) == ["ai", "ai", "user", "user"],
                 response=history_response
             )
-            
+
+            # Page back one message at a time; the user and ai messages of a turn can share a timestamp
+            pages, cursor = [], None
+            while len(pages) < 10:
+                page_response = requests.get(
+                    f"{API_URL}/chat/sessions/{session_id}/messages",
+                    params={"limit": 1, **({"before": cursor} if cursor else {})}
+                )
+                if page_response.status_code != 200:
+                    break
+                pages.append(page_response.json())
+                cursor = page_response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            paged_ids = [message["id"] for page in reversed(pages) for message in page]
+            log_test(
+                "Chat History Cursor Pagination",
+                all(len(page) == 1 for page in pages) and
+                paged_ids == [message["id"] for message in history_response.json()],
+                f"Pages: {len(pages)}, ids: {paged_ids}"
+            )
+
+            invalid_cursor_response = requests.get(
+                f"{API_URL}/chat/sessions/{session_id}/messages", params={"before": "not-a-cursor"}
+            )
+            log_test("Reject Invalid Chat Cursor", invalid_cursor_response.status_code == 400, response=invalid_cursor_response)
+
+            # List the user's chat sessions
+            sessions_response = requests.get(f"{API_URL}/users/{user_id}/chat/sessions")
+            log_test(
+                "List Chat Sessions",
+                sessions_response.status_code == 200 and
+                any(session["session_id"] == session_id for session in sessions_response.json()),
+                response=sessions_response
+            )
+
             return session_id
     except Exception as e:
         log_test("ChatGPT-4o Integration", False, f"Exception: {str(e)}")
@@ -412,6 +609,293 @@ def test_project_management(user_id):
     
     return None
 
+def test_section_tracking(user_id):
+    """Test that section completion keeps its meaning when a lesson's sections are edited"""
+    print("\n🔍 Testing Section Completion Tracking")
+
+    if not user_id:
+        log_test("Section Completion Tracking", False, "No user ID available for testing")
+        return
+
+    def section(section_id, title):
+        return {"id": section_id, "title": title, "duration": "5 min", "type": "theory", "content": {"text": title}}
+
+    try:
+        # A lesson of our own, so editing it leaves the seeded lessons untouched
+        lesson_data = {
+            "title": f"Section Tracking {uuid.uuid4().hex[:8]}",
+            "description": "Lesson edited by the backend tests",
+            "duration": "15 min",
+            "difficulty": "Beginner",
+            "topics": ["Testing"],
+            "content": {"sections": [section("intro", "Introduction"), section("dna", "DNA Basics")], "quiz": []}
+        }
+        create_response = requests.post(f"{API_URL}/lessons", json=lesson_data)
+        log_test(
+            "Create Lesson With Section Bits",
+            create_response.status_code == 200 and create_response.json().get("section_bits") == {"intro": 0, "dna": 1},
+            response=create_response
+        )
+        if create_response.status_code != 200:
+            return
+        lesson_id = create_response.json()["id"]
+
+        complete_response = requests.post(f"{API_URL}/users/{user_id}/lessons/{lesson_id}/sections/dna/complete")
+        log_test(
+            "Complete Lesson Section",
+            complete_response.status_code == 200 and complete_response.json()["completed_sections"] == ["dna"],
+            response=complete_response
+        )
+
+        # Insert a section ahead of the others and reverse their order
+        edited_content = {
+            "sections": [section("crispr", "CRISPR Tools"), section("dna", "DNA Basics"), section("intro", "Introduction")],
+            "quiz": []
+        }
+        update_response = requests.put(f"{API_URL}/lessons/{lesson_id}", json={"content": edited_content})
+        log_test(
+            "Edit Lesson Sections",
+            update_response.status_code == 200 and
+            update_response.json().get("section_bits") == {"intro": 0, "dna": 1, "crispr": 2},
+            response=update_response
+        )
+
+        sections_response = requests.get(f"{API_URL}/users/{user_id}/lessons/sections")
+        row = next((r for r in sections_response.json() if r["lesson_id"] == lesson_id), {}) \
+            if sections_response.status_code == 200 else {}
+        log_test(
+            "Completed Sections Survive Lesson Edit",
+            row.get("completed_sections") == ["dna"] and row.get("total_sections") == 3,
+            f"Completed sections: {row}"
+        )
+
+        analytics_response = requests.get(f"{API_URL}/analytics/lessons/{lesson_id}/sections")
+        completed = {s["id"]: s["completed"] for s in analytics_response.json().get("sections", [])} \
+            if analytics_response.status_code == 200 else {}
+        log_test(
+            "Section Analytics After Lesson Edit",
+            completed == {"crispr": 0, "dna": 1, "intro": 0},
+            f"Completed per section: {completed}"
+        )
+    except Exception as e:
+        log_test("Section Completion Tracking", False, f"Exception: {str(e)}")
+
+def test_offline_sync(user_id, lesson_id, scenario_id):
+    """Test batched offline sync and its replay safety"""
+    print("\n🔍 Testing Offline Sync")
+
+    if not user_id or not lesson_id:
+        log_test("Offline Sync", False, "No user or lesson ID available for testing")
+        return
+
+    try:
+        # Offline clients send both UTC "Z" times and naive times in one batch
+        completed_at = (datetime.utcnow() - timedelta(hours=1)).replace(microsecond=0)
+        events = [
+            {
+                "event_id": str(uuid.uuid4()),
+                "type": "lesson_progress",
+                "timestamp": (completed_at - timedelta(minutes=10)).isoformat() + "Z",
+                "data": {"lesson_id": lesson_id, "progress": 80}
+            },
+            {
+                "event_id": str(uuid.uuid4()),
+                "type": "lesson_progress",
+                "timestamp": completed_at.isoformat(),
+                "data": {"lesson_id": lesson_id, "progress": 100}
+            },
+            {
+                "event_id": str(uuid.uuid4()),
+                "type": "unknown_event",
+                "timestamp": completed_at.isoformat() + "Z",
+                "data": {}
+            }
+        ]
+        if scenario_id:
+            events.append({
+                "event_id": str(uuid.uuid4()),
+                "type": "ethical_decision",
+                "timestamp": completed_at.isoformat() + "Z",
+                "data": {"scenario_id": scenario_id, "selected_option": "A", "reasoning": "Decided offline"}
+            })
+
+        response = requests.post(f"{API_URL}/users/{user_id}/sync", json={"events": events})
+        result = response.json() if response.status_code == 200 else {}
+        log_test(
+            "Sync Offline Events",
+            response.status_code == 200 and
+            result.get("lesson_progress") == 1 and
+            result.get("ethical_decisions") == (1 if scenario_id else 0) and
+            [rejected["event_id"] for rejected in result.get("rejected", [])] == [events[2]["event_id"]],
+            response=response
+        )
+
+        # Replaying the same batch must not record anything twice
+        replay_response = requests.post(f"{API_URL}/users/{user_id}/sync", json={"events": events})
+        log_test(
+            "Sync Offline Events (Replay)",
+            replay_response.status_code == 200 and replay_response.json().get("ethical_decisions") == 0,
+            response=replay_response
+        )
+
+        progress_response = requests.get(f"{API_URL}/users/{user_id}/lessons/progress")
+        row = next((p for p in progress_response.json() if p["lesson_id"] == lesson_id), {}) \
+            if progress_response.status_code == 200 else {}
+        log_test(
+            "Sync Keeps Offline Completion Time",
+            row.get("completed") is True and
+            row.get("progress") == 100 and
+            str(row.get("completed_at", ""))[:19] == completed_at.isoformat(),
+            f"Progress row: {row}"
+        )
+    except Exception as e:
+        log_test("Offline Sync", False, f"Exception: {str(e)}")
+
+def test_gamification(user_id, scenario_id):
+    """Test points, level and streak updates from activity events"""
+    print("\n🔍 Testing Points, Level & Streak")
+
+    if not user_id or not scenario_id:
+        log_test("Gamification", False, "No user or scenario ID available for testing")
+        return
+
+    try:
+        before = requests.get(f"{API_URL}/users/{user_id}").json()
+        decision_response = requests.post(
+            f"{API_URL}/users/{user_id}/ethics/{scenario_id}/decision",
+            params={"selected_option": "B", "reasoning": "Weighing the trade-offs again"}
+        )
+        user_response = requests.get(f"{API_URL}/users/{user_id}")
+        user = user_response.json() if user_response.status_code == 200 else {}
+        points = user.get("total_points", 0)
+        log_test(
+            "Activity Awards Points",
+            decision_response.status_code == 200 and points >= before.get("total_points", 0) + 20,
+            f"Points: {before.get('total_points')} -> {points}"
+        )
+        log_test(
+            "Level Follows Points",
+            user.get("level") == 1 + points // 500,
+            f"Level {user.get('level')} at {points} points"
+        )
+        log_test(
+            "Streak Started Today",
+            user.get("streak") == 1 and user.get("last_active_day") == datetime.utcnow().date().isoformat(),
+            f"Streak {user.get('streak')}, last active {user.get('last_active_day')}"
+        )
+    except Exception as e:
+        log_test("Gamification", False, f"Exception: {str(e)}")
+
+def test_achievements(user_id):
+    """Test achievement unlocks and criteria validation"""
+    print("\n🔍 Testing Achievements")
+
+    try:
+        invalid_criteria = [{}, {"logins": 3}, {"lessons_completed": 0}, {"lessons_completed": "five"}]
+        statuses = [
+            requests.post(f"{API_URL}/achievements", json={
+                "name": "Invalid Achievement",
+                "description": "Criteria the engine cannot evaluate",
+                "icon": "🚫",
+                "criteria": criteria
+            }).status_code
+            for criteria in invalid_criteria
+        ]
+        log_test(
+            "Reject Unsupported Achievement Criteria",
+            statuses == [400] * len(invalid_criteria),
+            f"Status Codes: {statuses}"
+        )
+
+        if not user_id:
+            log_test("Achievement Unlocks", False, "No user ID available for testing")
+            return
+
+        # Earlier tests completed a lesson, made ethical decisions and created a project
+        response = requests.get(f"{API_URL}/users/{user_id}/achievements")
+        achievements = {a["id"]: a for a in response.json()} if response.status_code == 200 else {}
+        unlocked = sorted(a_id for a_id, a in achievements.items() if a["unlocked"])
+        log_test(
+            "Achievement Unlocks",
+            all(achievements.get(a_id, {}).get("unlocked") for a_id in ("first-lesson", "first-project")) and
+            all(a["unlocked_at"] for a in achievements.values() if a["unlocked"]),
+            f"Unlocked: {unlocked}"
+        )
+        scholar = achievements.get("lesson-scholar", {})
+        log_test(
+            "Achievement Progress",
+            not scholar.get("unlocked") and 0 < scholar.get("progress", 0) < 1,
+            f"Scholar progress: {scholar.get('progress')}"
+        )
+    except Exception as e:
+        log_test("Achievements", False, f"Exception: {str(e)}")
+
+def test_research_exports(user_id):
+    """Test streamed research exports in every format, with their filters"""
+    print("\n🔍 Testing Research Exports")
+
+    if not user_id:
+        log_test("Research Exports", False, "No user ID available for testing")
+        return
+
+    decision_columns = ["id", "user_id", "scenario_id", "selected_option", "reasoning", "created_at"]
+    try:
+        csv_response = requests.get(f"{API_URL}/exports/decisions", params={"user_id": user_id, "batch_size": 1})
+        rows = list(csv.reader(io.StringIO(csv_response.text))) if csv_response.status_code == 200 else [[]]
+        log_test(
+            "Export CSV",
+            csv_response.headers.get("Content-Type", "").startswith("text/csv") and
+            rows[0] == decision_columns and len(rows) > 1 and
+            all(row[1] == user_id for row in rows[1:]),
+            f"Header: {rows[0]}, rows: {len(rows) - 1}"
+        )
+
+        ndjson_response = requests.get(f"{API_URL}/exports/lesson_progress", params={"format": "ndjson", "user_id": user_id})
+        records = [json.loads(line) for line in ndjson_response.text.splitlines()] \
+            if ndjson_response.status_code == 200 else []
+        log_test(
+            "Export NDJSON",
+            len(records) > 0 and all(record["user_id"] == user_id for record in records) and
+            all("_id" not in record and "progress" in record for record in records),
+            f"Records: {len(records)}"
+        )
+
+        # The test user belongs to Science High School, grade 12
+        matching = requests.get(f"{API_URL}/exports/decisions", params={
+            "format": "ndjson", "user_id": user_id, "school": "Science High School", "grade": "12"
+        })
+        other_school = requests.get(f"{API_URL}/exports/decisions", params={
+            "format": "ndjson", "user_id": user_id, "school": f"No Such School {uuid.uuid4().hex[:8]}"
+        })
+        future = requests.get(f"{API_URL}/exports/decisions", params={
+            "format": "ndjson", "user_id": user_id,
+            "start": (datetime.utcnow() + timedelta(days=1)).isoformat()
+        })
+        log_test(
+            "Export Filters",
+            matching.status_code == 200 and len(matching.text.splitlines()) > 0 and
+            other_school.status_code == 200 and other_school.text == "" and
+            future.status_code == 200 and future.text == "",
+            f"Matching: {len(matching.text.splitlines())}, other school: {len(other_school.text)} bytes, "
+            f"future: {len(future.text)} bytes"
+        )
+
+        parquet_response = requests.get(f"{API_URL}/exports/simulations", params={"format": "parquet", "user_id": user_id})
+        log_test(
+            "Export Parquet",
+            parquet_response.status_code == 200 and
+            parquet_response.content[:4] == b"PAR1" and parquet_response.content[-4:] == b"PAR1",
+            f"Status Code: {parquet_response.status_code}, {len(parquet_response.content)} bytes"
+        )
+
+        statuses = [
+            requests.get(f"{API_URL}/exports/users").status_code,
+            requests.get(f"{API_URL}/exports/decisions", params={"format": "xlsx"}).status_code
+        ]
+        log_test("Export Rejects Unknown Collections And Formats", statuses == [404, 400], f"Status Codes: {statuses}")
+    except Exception as e:
+        log_test("Research Exports", False, f"Exception: {str(e)}")
+
 def test_analytics(user_id):
     """Test analytics endpoints"""
     print("\n🔍 Testing Analytics & User Data API")
@@ -427,6 +911,1163 @@ def test_analytics(user_id):
     except Exception as e:
         log_test("Analytics API", False, f"Exception: {str(e)}")
 
+# Server components that need no database are checked in-process
+def load_server():
+    """Import backend/server.py; its MongoDB client only connects on first use"""
+    backend_dir = str(Path(__file__).resolve().parent / "backend")
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    import server
+    return server
+
+def test_progress_buffer():
+    """Test progress write coalescing, per-user flushes and the shutdown flush"""
+    print("\n🔍 Testing Progress Write Buffer")
+
+    try:
+        server = load_server()
+        writes = []
+        fail_writes = False
+
+        async def apply_lesson_progress(entries, completed_times=None):
+            if fail_writes:
+                raise RuntimeError("database unavailable")
+            writes.append(dict(entries))
+
+        async def scenario():
+            nonlocal fail_writes
+            buffer = server.ProgressWriteBuffer(flush_interval=60, max_entries=100)
+            buffer.start()
+            await buffer.add("student-1", "lesson-1", 40)
+            await buffer.add("student-1", "lesson-1", 90)
+            await buffer.add("student-1", "lesson-1", 60)
+            await buffer.add("student-2", "lesson-1", 10)
+            coalesced = dict(buffer.pending)
+
+            await buffer.flush("student-1")
+            after_user_flush = dict(buffer.pending)
+
+            fail_writes = True
+            try:
+                await buffer.flush()
+            except RuntimeError:
+                pass
+            after_failed_flush = dict(buffer.pending)
+            fail_writes = False
+
+            await buffer.close()
+            return coalesced, after_user_flush, after_failed_flush, dict(buffer.pending)
+
+        original = server.apply_lesson_progress
+        server.apply_lesson_progress = apply_lesson_progress
+        try:
+            coalesced, after_user_flush, after_failed_flush, after_close = asyncio.run(scenario())
+        finally:
+            server.apply_lesson_progress = original
+
+        log_test(
+            "Progress Buffer Coalescing",
+            coalesced == {("student-1", "lesson-1"): 90, ("student-2", "lesson-1"): 10},
+            f"Pending: {coalesced}"
+        )
+        log_test(
+            "Progress Buffer Per-User Flush",
+            writes[:1] == [{("student-1", "lesson-1"): 90}] and after_user_flush == {("student-2", "lesson-1"): 10},
+            f"Writes: {writes}, pending: {after_user_flush}"
+        )
+        log_test(
+            "Progress Buffer Keeps Entries On Failed Flush",
+            after_failed_flush == {("student-2", "lesson-1"): 10},
+            f"Pending: {after_failed_flush}"
+        )
+        log_test(
+            "Progress Buffer Shutdown Flush",
+            writes[1:] == [{("student-2", "lesson-1"): 10}] and after_close == {},
+            f"Writes: {writes}, pending: {after_close}"
+        )
+    except Exception as e:
+        log_test("Progress Write Buffer", False, f"Exception: {str(e)}")
+
+def test_streak_rules():
+    """Test level thresholds and streak expiry"""
+    print("\n🔍 Testing Level & Streak Rules")
+
+    try:
+        server = load_server()
+        today = datetime.utcnow().date()
+        log_test(
+            "Level Thresholds",
+            [server.level_for_points(points) for points in (0, 499, 500, 1499, 1500)] == [1, 1, 2, 3, 4]
+        )
+        streaks = [
+            server.current_streak({"streak": 4, "last_active_day": (today - timedelta(days=days)).isoformat()})
+            for days in (0, 1, 2)
+        ]
+        log_test(
+            "Streak Expires After A Missed Day",
+            streaks == [4, 4, 0] and server.current_streak({"streak": 4}) == 0,
+            f"Streaks: {streaks}"
+        )
+    except Exception as e:
+        log_test("Level & Streak Rules", False, f"Exception: {str(e)}")
+
+def test_points_and_active_days():
+    """Test that points and levels can be awarded without marking the user active"""
+    print("\n🔍 Testing Points Without Activity")
+
+    class FakeUsers:
+        """users stand-in supporting the $inc/$set/$max updates award_points issues"""
+        def __init__(self, user):
+            self.user = user
+
+        def apply(self, update):
+            for field, value in update.get("$inc", {}).items():
+                self.user[field] = self.user.get(field, 0) + value
+            self.user.update(update.get("$set", {}))
+            for field, value in update.get("$max", {}).items():
+                self.user[field] = max(self.user.get(field, value), value)
+
+        def matches(self, query):
+            return all(self.user.get(field) == value for field, value in query.items())
+
+        async def find_one_and_update(self, query, update, **kwargs):
+            if not self.matches(query):
+                return None
+            self.apply(update)
+            return dict(self.user)
+
+        async def update_one(self, query, update):
+            if self.matches(query):
+                self.apply(update)
+
+    try:
+        server = load_server()
+        three_days_ago = (datetime.utcnow().date() - timedelta(days=3)).isoformat()
+        users = FakeUsers({"id": "student-1", "total_points": 480, "level": 1, "streak": 4, "last_active_day": three_days_ago})
+
+        async def scenario():
+            original_db = server.db
+            server.db = type("FakeDatabase", (), {"users": users})()
+            try:
+                # What an achievement unlock or backfill does
+                await server.award_points("student-1", 25)
+                after_unlock = dict(users.user)
+                # What a real activity event does on top
+                user = await server.award_points("student-1", 20)
+                await server.record_active_day("student-1", user)
+                await server.record_active_day("student-1", dict(users.user))
+                return after_unlock, dict(users.user)
+            finally:
+                server.db = original_db
+
+        after_unlock, after_activity = asyncio.run(scenario())
+        log_test(
+            "Achievement Points Leave Streak Alone",
+            after_unlock["total_points"] == 505 and after_unlock["level"] == 2 and
+            after_unlock["streak"] == 4 and after_unlock["last_active_day"] == three_days_ago,
+            f"User: {after_unlock}"
+        )
+        log_test(
+            "Activity Restarts A Broken Streak Once",
+            after_activity["streak"] == 1 and
+            after_activity["last_active_day"] == datetime.utcnow().date().isoformat(),
+            f"User: {after_activity}"
+        )
+    except Exception as e:
+        log_test("Points Without Activity", False, f"Exception: {str(e)}")
+
+def test_achievement_engine():
+    """Test achievement criteria compilation and progress"""
+    print("\n🔍 Testing Achievement Engine")
+
+    try:
+        server = load_server()
+        engine = server.AchievementEngine()
+        engine.load([
+            {"id": "two-lessons", "criteria": {"lessons_completed": 2}, "points": 10},
+            {"id": "mixed", "criteria": {"lessons_completed": 1, "projects_created": 2}},
+            {"id": "unsupported", "criteria": {"logins": 3}},
+            {"id": "zero", "criteria": {"ethical_decisions": 0}}
+        ])
+        log_test(
+            "Achievement Criteria Compilation",
+            sorted(engine.thresholds) == ["mixed", "two-lessons"] and
+            sorted(engine.by_counter["lessons_completed"]) == ["mixed", "two-lessons"] and
+            engine.by_counter["projects_created"] == ["mixed"] and
+            "ethical_decisions" not in engine.by_counter,
+            f"Thresholds: {engine.thresholds}"
+        )
+        stats = {"lessons_completed": 1, "projects_created": 1}
+        progress = {a_id: engine.progress(stats, a_id) for a_id in engine.thresholds}
+        log_test(
+            "Achievement Progress Calculation",
+            progress == {"two-lessons": 0.5, "mixed": 0.75},
+            f"Progress: {progress}"
+        )
+    except Exception as e:
+        log_test("Achievement Engine", False, f"Exception: {str(e)}")
+
+def test_quiz_answer_keys():
+    """Test lesson content validation and answer keys that can never match a skipped question"""
+    print("\n🔍 Testing Quiz Answer Keys")
+
+    try:
+        server = load_server()
+
+        def rejected(content):
+            try:
+                server.validate_lesson_content(content)
+            except server.HTTPException as e:
+                return e.status_code == 400
+            return False
+
+        question = {"question": "Which?", "options": ["A", "B"], "correct": 1}
+        log_test(
+            "Lesson Content Validation",
+            not rejected({"sections": [{"id": 1}], "quiz": [question]}) and
+            not rejected({}) and
+            all(rejected(content) for content in [
+                {"quiz": [{**question, "correct": None}]},
+                {"quiz": [{**question, "correct": True}]},
+                {"quiz": [{**question, "correct": -1}]},
+                {"quiz": [{**question, "options": []}]},
+                {"quiz": ["Which?"]},
+                {"quiz": {"question": "Which?"}},
+                {"sections": [{"title": "No id"}]},
+                {"sections": "Introduction"}
+            ])
+        )
+
+        keys = [server.quiz_answer_key(q) for q in ({"correct": 2}, {}, {"correct": "B"}, {"correct": -1})]
+        log_test(
+            "Unkeyed Questions Never Match Unanswered",
+            keys == [2, server.QUIZ_NO_KEY, server.QUIZ_NO_KEY, server.QUIZ_NO_KEY] and
+            server.QUIZ_NO_KEY != server.QUIZ_UNANSWERED and server.QUIZ_NO_KEY < 0,
+            f"Keys: {keys}"
+        )
+
+        lesson = {"id": "quiz-lesson", "content": {"quiz": [{**question, "explanation": "B is right"}]}}
+        public = server.public_lesson(lesson)
+        log_test(
+            "Public Lesson Payload Hides Answers",
+            public["content"]["quiz"] == [{"question": "Which?", "options": ["A", "B"]}] and
+            lesson["content"]["quiz"][0]["correct"] == 1,
+            f"Public quiz: {public['content']['quiz']}"
+        )
+    except Exception as e:
+        log_test("Quiz Answer Keys", False, f"Exception: {str(e)}")
+
+def test_section_bits():
+    """Test section bit assignment for new, edited and pre-versioning lessons"""
+    print("\n🔍 Testing Section Bit Assignment")
+
+    try:
+        server = load_server()
+        # Seeded lessons carry neither version nor section_bits; their masks were written in section order
+        seeded = {"id": "1", "content": {"sections": [{"id": 1}, {"id": 2}, {"id": 3}]}}
+        legacy_bits = server.lesson_section_bits(seeded)
+        log_test("Legacy Lessons Use Section Order", legacy_bits == {"1": 0, "2": 1, "3": 2}, f"Bits: {legacy_bits}")
+
+        edited = server.assign_section_bits([{"id": 3}, {"id": 5}, {"id": 1}], legacy_bits)
+        log_test(
+            "Edited Sections Keep Their Bits",
+            edited == {"1": 0, "2": 1, "3": 2, "5": 3},
+            f"Bits: {edited}"
+        )
+
+        # Bits of removed sections are never handed out again
+        stored = {"content": {"sections": [{"id": 6}]}, "section_bits": edited}
+        readded = server.assign_section_bits([{"id": 2}, {"id": 6}], server.lesson_section_bits(stored))
+        log_test(
+            "Removed Section Bits Are Not Reused",
+            readded["2"] == 1 and readded["6"] == 4,
+            f"Bits: {readded}"
+        )
+    except Exception as e:
+        log_test("Section Bit Assignment", False, f"Exception: {str(e)}")
+
+def test_export_streams():
+    """Test CSV and NDJSON export serialization of batches"""
+    print("\n🔍 Testing Export Streams")
+
+    try:
+        server = load_server()
+        columns = ["id", "completed_at", "details"]
+        batches = [
+            [{"id": "a", "completed_at": datetime(2024, 5, 1, 12, 30), "details": {"score": 3}}],
+            [{"id": "b, quoted"}]
+        ]
+
+        async def collect(stream):
+            return "".join([chunk async for chunk in stream])
+
+        async def replay():
+            for batch in batches:
+                yield batch
+
+        csv_text = asyncio.run(collect(server.stream_csv(replay(), columns)))
+        ndjson_text = asyncio.run(collect(server.stream_ndjson(replay(), columns)))
+        log_test(
+            "Export CSV Serialization",
+            list(csv.reader(io.StringIO(csv_text))) == [
+                columns, ["a", "2024-05-01T12:30:00", '{"score": 3}'], ["b, quoted", "", ""]
+            ],
+            f"CSV: {csv_text!r}"
+        )
+        log_test(
+            "Export NDJSON Serialization",
+            [json.loads(line) for line in ndjson_text.splitlines()] == [
+                {"id": "a", "completed_at": "2024-05-01T12:30:00", "details": '{"score": 3}'},
+                {"id": "b, quoted", "completed_at": None, "details": None}
+            ],
+            f"NDJSON: {ndjson_text!r}"
+        )
+    except Exception as e:
+        log_test("Export Streams", False, f"Exception: {str(e)}")
+
+def test_cohort_rollups():
+    """Test cohort date ranges and which sources a day's rollup recounts"""
+    print("\n🔍 Testing Cohort Rollups")
+
+    try:
+        server = load_server()
+        start, end = server.cohort_day_range(None, "2024-3-5")
+        log_test("Cohort Range Defaults To 30 Days", (start, end) == ("2024-02-05", "2024-03-05"), f"Range: {start} - {end}")
+
+        try:
+            server.cohort_day_range("2024-02-30", None)
+            log_test("Reject Malformed Cohort Range", False, "No error raised")
+        except server.HTTPException as e:
+            log_test("Reject Malformed Cohort Range", e.status_code == 400, f"Status: {e.status_code}")
+
+        # Lesson activity is counted from append-only events, never a row's moving updated_at
+        mutable = [field for _, field, changed, _, _ in server.COHORT_SOURCES if field == changed and field != "ts"]
+        log_test("Cohort Sources Keyed On Fixed Times", not mutable, f"Mutable keys: {mutable}")
+
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        recent_source, recent = server.cohort_rollup_pipeline(today, today + timedelta(days=1), "run")
+        old_day = today - timedelta(days=server.ACTIVITY_EVENT_RETENTION_DAYS + 1)
+        old_source, old = server.cohort_rollup_pipeline(old_day, old_day + timedelta(days=1), "run")
+        unions = [stage["$unionWith"]["coll"] for stage in old if "$unionWith" in stage]
+        log_test(
+            "Expired Days Keep Stored Lesson Activity",
+            recent_source.name == "activity_events" and recent[-1]["$merge"]["whenMatched"] == "replace"
+            and old_source.name != "activity_events" and "activity_events" not in unions
+            and isinstance(old[-1]["$merge"]["whenMatched"], list),
+            f"Sources: {recent_source.name}, {old_source.name} + {unions}"
+        )
+    except Exception as e:
+        log_test("Cohort Rollups", False, f"Exception: {str(e)}")
+
+def test_search_index():
+    """Test lesson search ranking, prefix matching and index updates"""
+    print("\n🔍 Testing Lesson Search Index")
+
+    try:
+        server = load_server()
+        index = server.SearchIndex()
+        index.add("crispr", "CRISPR gene editing CRISPR tools for crops")
+        index.add("climate", "Climate change and drought resistant crops")
+        index.add("ethics", "Ethics of genetic engineering")
+
+        log_test(
+            "Search Ranks Exact Matches First",
+            [key for key, _ in index.search("crispr crops")][:2] == ["crispr", "climate"],
+            f"Hits: {index.search('crispr crops')}"
+        )
+        log_test(
+            "Search Prefix Matching",
+            {key for key, _ in index.search("gen")} == {"crispr", "ethics"},
+            f"Hits: {index.search('gen')}"
+        )
+        contraction_hits = index.search("what's the")
+        log_test(
+            "Search Ignores Stopwords And Contraction Fragments",
+            contraction_hits == [],
+            f"Hits: {contraction_hits}"
+        )
+
+        index.add("crispr", "Base editing")
+        index.remove("ethics")
+        log_test(
+            "Search Index Updates And Removal",
+            index.search("crispr") == [] and index.search("ethics") == [] and
+            [key for key, _ in index.search("editing")] == ["crispr"],
+            f"Documents: {sorted(index.doc_lengths)}"
+        )
+    except Exception as e:
+        log_test("Lesson Search Index", False, f"Exception: {str(e)}")
+
+def test_lesson_passages():
+    """Test lesson passage matching and the coverage rules for grounded tutor answers"""
+    print("\n🔍 Testing Lesson Passage Matching")
+
+    try:
+        server = load_server()
+        lessons = [
+            {"id": "passage-test-1", "title": "Climate Change & Genetic Adaptation", "content": {"sections": [
+                {"id": 1, "title": "Climate Change Challenges", "content": {
+                    "text": "Climate change is happening faster than natural adaptation can occur. Rising temperatures and extreme weather create survival challenges for all life forms.",
+                    "key_points": ["Global temperature has risen 1.1°C since 1880"]
+                }},
+                {"id": 2, "title": "Natural Selection", "content": {
+                    "text": "Natural selection favors genetic variants that survive heat and drought."
+                }}
+            ]}},
+            {"id": "passage-test-2", "title": "Gene Editing Basics", "content": {"sections": [
+                {"id": 1, "title": "CRISPR Tools", "content": {
+                    "text": "CRISPR-Cas9 cuts DNA at a guided location so genes can be edited.",
+                    "case_studies": [{"title": "Drought Tolerant Maize", "description": "Edited maize keeps its yield in dry seasons"}]
+                }}
+            ]}}
+        ]
+        for lesson in lessons:
+            server.index_lesson_passages(lesson)
+
+        try:
+            match = server.match_lesson_passage("What's climate change?")
+            passage, coverage, title_match = match or (None, 0, False)
+            log_test(
+                "Passage Match By Title",
+                passage is not None and passage["title"] == "Climate Change Challenges" and coverage == 1.0 and title_match,
+                f"Match: {passage and passage['title']}, coverage: {coverage}, title match: {title_match}"
+            )
+
+            reply, prompt = server.local_reply("What's climate change?", first_turn=False)
+            log_test(
+                "Fully Covered Question Answered From Lesson",
+                prompt is None and reply.startswith("Climate Change Challenges:"),
+                f"Reply: {reply!r}"
+            )
+
+            confused = server.match_lesson_passage("I'm confused")
+            log_test("Vague Question Has No Passage", confused is None, f"Match: {confused}")
+
+            # Most terms covered but not all: the passage is context for the LLM, not the answer
+            reply, prompt = server.local_reply("Does edited maize keep its yield on Mars?", first_turn=False)
+            log_test(
+                "Partly Covered Question Goes To LLM With Context",
+                reply is None and "Drought Tolerant Maize" in prompt,
+                f"Prompt: {prompt!r}"
+            )
+
+            # Re-indexing a lesson replaces its passages
+            server.index_lesson_passages({**lessons[1], "content": {"sections": []}})
+            stale = server.match_lesson_passage("CRISPR tools")
+            log_test("Re-indexed Lesson Drops Old Passages", stale is None, f"Match: {stale}")
+        finally:
+            for lesson in lessons:
+                server.index_lesson_passages({"id": lesson["id"], "content": {}})
+    except Exception as e:
+        log_test("Lesson Passage Matching", False, f"Exception: {str(e)}")
+
+def test_chat_context():
+    """Test the rolling tutor context: recent turns verbatim, older turns folded into the summary"""
+    print("\n🔍 Testing Chat Context Summary")
+
+    class FakeSessions:
+        def __init__(self):
+            self.docs = {}
+
+        async def find_one(self, query, projection=None):
+            doc = self.docs.get(query["session_id"])
+            return None if doc is None else {field: doc[field] for field in ("summary", "recent_turns") if field in doc}
+
+        async def update_one(self, query, update, upsert=False):
+            doc = self.docs.setdefault(query["session_id"], dict(update.get("$setOnInsert", {})))
+            doc.update(update["$set"])
+
+    try:
+        server = load_server()
+        sessions = FakeSessions()
+        original_db = server.db
+        server.db = type("FakeDatabase", (), {"chat_sessions": sessions})()
+        recent_limit, summary_limit = server.CHAT_CONTEXT_RECENT_TURNS, server.CHAT_SUMMARY_MAX_LINES
+        try:
+            def exchange(i):
+                return {"user": f"Question {i}? Some more detail.", "ai": f"Answer {i}. " + "Long explanation " * 20}
+
+            async def scenario():
+                # One turn at a time, then a writer batch carrying several turns at once
+                for i in range(recent_limit + 1):
+                    await server.update_chat_context("session-1", "student-1", [exchange(i)])
+                first = dict(sessions.docs["session-1"])
+                await server.update_chat_context(
+                    "session-1", "student-1", [exchange(i) for i in range(recent_limit + 1, recent_limit + summary_limit + 3)]
+                )
+                return first, sessions.docs["session-1"]
+
+            first, after = asyncio.run(scenario())
+        finally:
+            server.db = original_db
+
+        log_test(
+            "Chat Context Overflow Folds Oldest Turn",
+            len(first["recent_turns"]) == recent_limit and first["recent_turns"][0]["user"].startswith("Question 1?")
+            and first["summary"] == ["Student asked: Question 0? Tutor: Answer 0."],
+            f"Summary: {first['summary']}"
+        )
+        total = recent_limit + summary_limit + 3
+        log_test(
+            "Chat Context Summary Is Capped",
+            len(after["recent_turns"]) == recent_limit and len(after["summary"]) == summary_limit
+            and after["summary"][-1].startswith(f"Student asked: Question {total - recent_limit - 1}?")
+            and after["recent_turns"][-1]["user"].startswith(f"Question {total - 1}?"),
+            f"Summary lines: {len(after['summary'])}, last: {after['summary'][-1]!r}"
+        )
+
+        long_reply = server.summarize_turn({"user": "Why? " + "x" * 400, "ai": "y" * 400})
+        log_test(
+            "Chat Summary Lines Are Bounded",
+            len(long_reply) <= 2 * server.CHAT_SUMMARY_SNIPPET_CHARS + 30 and long_reply.endswith("..."),
+            f"Length: {len(long_reply)}"
+        )
+    except Exception as e:
+        log_test("Chat Context Summary", False, f"Exception: {str(e)}")
+
+def test_chat_history_pages():
+    """Test chat history cursors, including messages that share a timestamp"""
+    print("\n🔍 Testing Chat History Pagination")
+
+    class FakeCursor:
+        def __init__(self, docs):
+            self.docs = docs
+
+        def sort(self, keys):
+            for field, direction in reversed(keys):
+                self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+            return self
+
+        def limit(self, count):
+            self.docs = self.docs[:count]
+            return self
+
+        async def to_list(self, length):
+            return [dict(doc) for doc in self.docs[:length]]
+
+    class FakeMessages:
+        def __init__(self, docs):
+            self.docs = docs
+
+        @staticmethod
+        def matches(doc, condition):
+            for field, value in condition.items():
+                if isinstance(value, dict):
+                    if not doc[field] < value["$lt"]:
+                        return False
+                elif doc[field] != value:
+                    return False
+            return True
+
+        def find(self, query):
+            branches = query.get("$or", [{}])
+            base = {field: value for field, value in query.items() if field != "$or"}
+            return FakeCursor([
+                doc for doc in self.docs
+                if self.matches(doc, base) and any(self.matches(doc, branch) for branch in branches)
+            ])
+
+    class FakeResponse:
+        def __init__(self):
+            self.headers = {}
+
+    try:
+        server = load_server()
+        tied = datetime(2024, 5, 1, 12, 0, 0)
+        # Five messages share one timestamp, so only the id orders them
+        docs = [
+            {"_id": i, "id": f"message-{i:02d}", "session_id": "session-1",
+             "timestamp": tied if 2 <= i <= 6 else tied + timedelta(seconds=i - 4)}
+            for i in range(10)
+        ] + [{"_id": 99, "id": "message-99", "session_id": "session-2", "timestamp": tied}]
+        original_db = server.db
+        server.db = type("FakeDatabase", (), {"chat_messages": FakeMessages(docs)})()
+        try:
+            async def walk(limit):
+                pages, cursor = [], None
+                while True:
+                    response = FakeResponse()
+                    pages.append(await server.get_chat_messages("session-1", response, limit=limit, before=cursor))
+                    cursor = response.headers.get("X-Next-Cursor")
+                    if not cursor:
+                        return pages
+
+            by_three = asyncio.run(walk(3))
+            by_one = asyncio.run(walk(1))
+        finally:
+            server.db = original_db
+
+        expected = sorted((doc["timestamp"], doc["id"]) for doc in docs if doc["session_id"] == "session-1")
+        expected_ids = [message_id for _, message_id in expected]
+        paged_ids = [[message["id"] for message in page] for page in by_three]
+        log_test(
+            "Chat Pages Are Newest First, Chronological Within",
+            paged_ids[0] == expected_ids[-3:] and [len(page) for page in paged_ids] == [3, 3, 3, 1],
+            f"Pages: {paged_ids}"
+        )
+        log_test(
+            "Chat Cursor Survives Timestamp Ties",
+            [message["id"] for page in reversed(by_three) for message in page] == expected_ids and
+            [message["id"] for page in reversed(by_one) for message in page] == expected_ids,
+            f"Walked: {[message['id'] for page in reversed(by_one) for message in page]}"
+        )
+
+        cursor = server.encode_chat_cursor({"timestamp": tied, "id": "message-04"})
+        log_test(
+            "Chat Cursor Round Trip",
+            server.decode_chat_cursor(cursor) == (tied, "message-04"),
+            f"Cursor: {cursor}"
+        )
+        invalid = [
+            "not-a-cursor",
+            base64.urlsafe_b64encode(b"[1, 2]").decode("ascii"),
+            base64.urlsafe_b64encode(b'{"timestamp": "x"}').decode("ascii"),
+            "é"
+        ]
+        statuses = []
+        for value in invalid:
+            try:
+                server.decode_chat_cursor(value)
+                statuses.append(None)
+            except server.HTTPException as e:
+                statuses.append(e.status_code)
+        log_test("Reject Invalid Chat Cursors", statuses == [400] * len(invalid), f"Statuses: {statuses}")
+    except Exception as e:
+        log_test("Chat History Pagination", False, f"Exception: {str(e)}")
+
+def test_chat_stream():
+    """Test the chat SSE event sequence, the open-circuit fallback and upstream cancellation on disconnect"""
+    print("\n🔍 Testing Chat Streaming")
+
+    class FakeWriter:
+        def __init__(self):
+            self.turns = []
+
+        async def add(self, messages, context_turn=None):
+            self.turns.append(([message.dict()["sender"] for message in messages], context_turn))
+
+    class TrackedChat:
+        """FakeChat wrapper recording whether the upstream stream ran and was cancelled"""
+        def __init__(self, chat):
+            self.chat = chat
+            self.started = False
+            self.cancelled = False
+
+        async def stream_message(self, message):
+            self.started = True
+            try:
+                async for token in self.chat.stream_message(message):
+                    yield token
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+
+    def parse(chunk):
+        event, data = chunk.strip().split("\n")
+        return event[len("event: "):], json.loads(data[len("data: "):])
+
+    try:
+        server = load_server()
+        backend = server.FakeLLMBackend(
+            median_latency=0, latency_sigma=0, token_delay=0.001, reply_tokens=6, error_rate=0, seed=1
+        )
+        patched = ("chat_writer", "session_chat_client", "llm_limiter", "llm_breaker")
+        originals = {name: getattr(server, name) for name in patched}
+
+        async def run(steps, failure_threshold=5):
+            writer = FakeWriter()
+            chat = TrackedChat(backend.create_chat("session-1", "system"))
+            limiter = server.LLMConcurrencyLimiter(
+                max_concurrent=2, max_per_user=1, max_queue=0, queue_timeout=1, call_timeout=5
+            )
+            breaker = server.CircuitBreaker(failure_threshold=failure_threshold, slow_call_seconds=5, reset_timeout=60)
+
+            async def session_chat_client(session_id, first_turn=False, context=None):
+                return chat
+
+            server.chat_writer, server.session_chat_client = writer, session_chat_client
+            server.llm_limiter, server.llm_breaker = limiter, breaker
+            try:
+                result = await steps(breaker)
+                await asyncio.sleep(0.01)
+            finally:
+                for name, value in originals.items():
+                    setattr(server, name, value)
+            return result, writer, chat, limiter, breaker
+
+        async def full_stream(breaker):
+            response = await server.stream_chat_message("session-1", "student-1", "How does CRISPR work?")
+            return [parse(chunk) async for chunk in response.body_iterator]
+
+        events, writer, chat, limiter, breaker = asyncio.run(run(full_stream))
+        names = [name for name, _ in events]
+        tokens = "".join(data["text"] for name, data in events if name == "token")
+        log_test(
+            "Chat Stream Event Sequence",
+            names == ["user_message"] + ["token"] * 6 + ["done"] and
+            events[0][1]["message"] == "How does CRISPR work?" and events[-1][1]["message"] == tokens,
+            f"Events: {names}"
+        )
+        log_test(
+            "Chat Stream Stores Turn And Context",
+            writer.turns == [(["user"], None), (["ai"], {"user": "How does CRISPR work?", "ai": tokens})] and
+            limiter.in_flight == 0 and len(breaker.latencies) == 1,
+            f"Writes: {writer.turns}, in flight: {limiter.in_flight}, breaker: {breaker.status()}"
+        )
+
+        # The client goes away after two tokens: the provider stream is cancelled and the slot freed
+        async def disconnect(breaker):
+            response = await server.stream_chat_message("session-1", "student-1", "How does CRISPR work?")
+            received = []
+            async for chunk in response.body_iterator:
+                received.append(parse(chunk)[0])
+                if received.count("token") == 2:
+                    break
+            await response.body_iterator.aclose()
+            return received
+
+        received, writer, chat, limiter, breaker = asyncio.run(run(disconnect))
+        log_test(
+            "Chat Stream Disconnect Cancels Upstream",
+            chat.cancelled and limiter.in_flight == 0 and writer.turns == [(["user"], None)] and
+            breaker.failures == 0,
+            f"Received: {received}, cancelled: {chat.cancelled}, in flight: {limiter.in_flight}"
+        )
+
+        # An open circuit answers with the fallback without calling the provider
+        async def open_circuit(breaker):
+            breaker.record(False, 0)
+            return await full_stream(breaker)
+
+        events, writer, chat, limiter, breaker = asyncio.run(run(open_circuit, failure_threshold=1))
+        names = [name for name, _ in events]
+        log_test(
+            "Chat Stream Falls Back On Open Circuit",
+            names == ["user_message", "token", "done"] and not chat.started and
+            breaker.short_circuited == 1 and writer.turns[-1] == (["ai"], None) and limiter.in_flight == 0,
+            f"Events: {names}, provider called: {chat.started}, breaker: {breaker.status()}"
+        )
+    except Exception as e:
+        log_test("Chat Streaming", False, f"Exception: {str(e)}")
+
+def test_fake_llm_backend():
+    """Test the load-test LLM stand-in: seeded latency, error injection, replies and streaming"""
+    print("\n🔍 Testing Fake LLM Backend")
+
+    try:
+        server = load_server()
+
+        def backend(**overrides):
+            settings = dict(median_latency=0.8, latency_sigma=0.5, token_delay=0, reply_tokens=12, error_rate=0, seed=7)
+            settings.update(overrides)
+            return server.FakeLLMBackend(**settings)
+
+        # A seed replays the same latencies; across draws they center on the configured median
+        seeded = backend()
+        delays = [seeded.first_token_delay() for _ in range(500)]
+        replayed = backend()
+        median = sorted(delays)[len(delays) // 2]
+        log_test(
+            "Fake Backend Latency",
+            [replayed.first_token_delay() for _ in range(500)] == delays and min(delays) > 0 and
+            0.7 < median < 0.9 and backend(median_latency=0).first_token_delay() == 0.0,
+            f"Median of 500 draws: {median:.3f}s"
+        )
+
+        failing = backend(error_rate=1.0)
+        reliable = backend(error_rate=0.0)
+        try:
+            failing.maybe_fail()
+            injected = False
+        except RuntimeError:
+            injected = True
+        reliable.maybe_fail()
+        rate = backend(error_rate=0.25, seed=3)
+        failures = 0
+        for _ in range(1000):
+            try:
+                rate.maybe_fail()
+            except RuntimeError:
+                failures += 1
+        log_test("Fake Backend Error Injection", injected and 200 < failures < 300, f"Failures at 25%: {failures}/1000")
+
+        async def exchange():
+            chat = backend(median_latency=0.01, token_delay=0.001).create_chat("session-1", "system")
+            message = server.UserMessage(text="How does CRISPR help crops?")
+            started = time.monotonic()
+            reply = await chat.send_message(message)
+            elapsed = time.monotonic() - started
+            streamed = [token async for token in chat.stream_message(message)]
+            failed_stream = backend(median_latency=0, error_rate=1.0).create_chat("session-2", "system")
+            try:
+                async for _ in failed_stream.stream_message(message):
+                    pass
+                stream_failed = False
+            except RuntimeError:
+                stream_failed = True
+            return reply, elapsed, streamed, stream_failed
+
+        reply, elapsed, streamed, stream_failed = asyncio.run(exchange())
+        log_test(
+            "Fake Backend Replies And Streams",
+            len(reply.split()) == 12 and "".join(streamed).strip() == reply and len(streamed) == 12
+            and elapsed >= 12 * 0.001 and stream_failed,
+            f"Reply: {reply!r}, tokens: {len(streamed)}, took {elapsed:.3f}s"
+        )
+        log_test(
+            "LLM Backend Selection",
+            server.create_llm_backend("fake").name == "fake" and isinstance(server.create_llm_backend("fake"), server.LLMBackend),
+            f"Backend: {server.create_llm_backend('fake').name}"
+        )
+    except Exception as e:
+        log_test("Fake LLM Backend", False, f"Exception: {str(e)}")
+
+def test_answer_cache():
+    """Test tutor answer cache normalization, LRU eviction and expiry"""
+    print("\n🔍 Testing Tutor Answer Cache")
+
+    try:
+        server = load_server()
+        cache = server.AnswerCache(max_entries=2, ttl=60)
+        cache.put("What is CRISPR?", "answer-crispr")
+        log_test(
+            "Answer Cache Normalized Hit",
+            cache.get("  what is   crispr ") == "answer-crispr" and cache.get("What is DNA?") is None
+        )
+
+        # "crispr" was used last, so adding a third answer evicts "dna"
+        cache.put("What is DNA?", "answer-dna")
+        cache.get("What is CRISPR?")
+        cache.put("What is RNA?", "answer-rna")
+        log_test(
+            "Answer Cache LRU Eviction",
+            cache.get("What is DNA?") is None and
+            cache.get("What is CRISPR?") == "answer-crispr" and
+            cache.get("What is RNA?") == "answer-rna" and
+            cache.stats()["evictions"] == 1,
+            f"Stats: {cache.stats()}"
+        )
+
+        expiring = server.AnswerCache(max_entries=2, ttl=0.05)
+        expiring.put("What is CRISPR?", "answer-crispr")
+        time.sleep(0.1)
+        log_test(
+            "Answer Cache Expiry",
+            expiring.get("What is CRISPR?") is None and expiring.stats()["size"] == 0,
+            f"Stats: {expiring.stats()}"
+        )
+    except Exception as e:
+        log_test("Tutor Answer Cache", False, f"Exception: {str(e)}")
+
+def test_llm_limiter():
+    """Test LLM call admission, queueing, load shedding and timeouts"""
+    print("\n🔍 Testing LLM Concurrency Limiter")
+
+    try:
+        server = load_server()
+
+        async def rejection(make_request):
+            try:
+                await make_request()
+            except server.HTTPException as e:
+                return e
+            return None
+
+        async def scenario():
+            limiter = server.LLMConcurrencyLimiter(
+                max_concurrent=1, max_per_user=1, max_queue=1, queue_timeout=0.2, call_timeout=0.5
+            )
+            release = asyncio.Event()
+
+            async def held_call():
+                await release.wait()
+                return "reply"
+
+            first = asyncio.create_task(limiter.call("student-1", held_call))
+            await asyncio.sleep(0.01)
+            same_user = await rejection(lambda: limiter.call("student-1", held_call))
+            queued = asyncio.create_task(limiter.call("student-2", held_call))
+            await asyncio.sleep(0.01)
+            queue_depth = limiter.stats()["queue_depth"]
+            queue_full = await rejection(lambda: limiter.call("student-3", held_call))
+            release.set()
+            replies = await asyncio.gather(first, queued)
+            drained = (limiter.in_flight, limiter.waiting, dict(limiter.user_calls))
+
+            # A queued request gives up after queue_timeout; a cancelled one leaves no trace
+            release.clear()
+            holder = asyncio.create_task(limiter.call("student-1", held_call))
+            await asyncio.sleep(0.01)
+            timed_out = await rejection(lambda: limiter.call("student-2", held_call))
+            cancelled = asyncio.create_task(limiter.call("student-3", held_call))
+            await asyncio.sleep(0.01)
+            cancelled.cancel()
+            await asyncio.gather(cancelled, return_exceptions=True)
+            release.set()
+            await holder
+
+            try:
+                await limiter.call("student-1", lambda: asyncio.sleep(5))
+                call_timed_out = False
+            except asyncio.TimeoutError:
+                call_timed_out = True
+            after = (limiter.in_flight, limiter.waiting, dict(limiter.user_calls))
+            return same_user, queue_depth, queue_full, replies, drained, timed_out, call_timed_out, after, limiter.stats()
+
+        same_user, queue_depth, queue_full, replies, drained, timed_out, call_timed_out, after, stats = asyncio.run(scenario())
+        log_test(
+            "LLM Limiter Per-User Limit",
+            same_user is not None and same_user.status_code == 429,
+            f"Rejection: {getattr(same_user, 'detail', None)}"
+        )
+        log_test(
+            "LLM Limiter Sheds Load With Retry-After",
+            queue_depth == 1 and queue_full is not None and queue_full.status_code == 429 and
+            int(queue_full.headers.get("Retry-After", "0")) >= 1,
+            f"Queue depth: {queue_depth}, headers: {getattr(queue_full, 'headers', None)}"
+        )
+        log_test(
+            "LLM Limiter Queued Call Admitted",
+            replies == ["reply", "reply"] and drained == (0, 0, {}),
+            f"Replies: {replies}, in flight/waiting/users: {drained}"
+        )
+        log_test(
+            "LLM Limiter Queue Timeout",
+            timed_out is not None and timed_out.status_code == 429 and stats["queue_timeouts"] == 1,
+            f"Rejection: {getattr(timed_out, 'detail', None)}"
+        )
+        log_test(
+            "LLM Limiter Call Timeout And Cancellation Release Slots",
+            call_timed_out and after == (0, 0, {}),
+            f"In flight/waiting/users: {after}, stats: {stats}"
+        )
+    except Exception as e:
+        log_test("LLM Concurrency Limiter", False, f"Exception: {str(e)}")
+
+def test_circuit_breaker():
+    """Test circuit breaker transitions and the spare slots used by hedged calls"""
+    print("\n🔍 Testing LLM Circuit Breaker")
+
+    try:
+        server = load_server()
+        breaker = server.CircuitBreaker(failure_threshold=2, slow_call_seconds=1.0, reset_timeout=0.05)
+
+        def short_circuited():
+            try:
+                breaker.check()
+            except server.CircuitOpenError:
+                return True
+            return False
+
+        # A slow success counts as a failure; two in a row open the circuit
+        breaker.record(False, 0.1)
+        still_closed = breaker.state == breaker.CLOSED and not short_circuited()
+        breaker.record(True, 2.0)
+        log_test(
+            "Circuit Opens After Consecutive Failures",
+            still_closed and breaker.state == breaker.OPEN and short_circuited(),
+            f"Status: {breaker.status()}"
+        )
+
+        time.sleep(0.1)
+        probe_allowed = not short_circuited()
+        second_blocked = short_circuited()
+        breaker.record(False, 0.1)
+        log_test(
+            "Circuit Half-Open Probe Failure Reopens",
+            probe_allowed and second_blocked and breaker.state == breaker.OPEN,
+            f"Status: {breaker.status()}"
+        )
+
+        time.sleep(0.1)
+        probe_allowed = not short_circuited()
+        breaker.record(True, 0.1)
+        log_test(
+            "Circuit Half-Open Probe Success Closes",
+            probe_allowed and breaker.state == breaker.CLOSED and not short_circuited() and breaker.trips == 2,
+            f"Status: {breaker.status()}"
+        )
+
+        # Hedged calls only ever take a free slot, never one a queued request is waiting for
+        async def spare_slots():
+            limiter = server.LLMConcurrencyLimiter(
+                max_concurrent=1, max_per_user=2, max_queue=1, queue_timeout=1, call_timeout=1
+            )
+            free = await limiter.try_acquire_spare()
+            busy = await limiter.try_acquire_spare()
+            limiter.release_spare()
+            release = asyncio.Event()
+            holder = asyncio.create_task(limiter.call("student-1", release.wait))
+            queued = asyncio.create_task(limiter.call("student-2", release.wait))
+            await asyncio.sleep(0.01)
+            while_queued = await limiter.try_acquire_spare()
+            release.set()
+            await asyncio.gather(holder, queued)
+            return free, busy, while_queued, limiter.in_flight
+
+        free, busy, while_queued, in_flight = asyncio.run(spare_slots())
+        log_test(
+            "Hedged Calls Use Only Spare Slots",
+            free and not busy and not while_queued and in_flight == 0,
+            f"Free: {free}, busy: {busy}, while queued: {while_queued}, in flight: {in_flight}"
+        )
+    except Exception as e:
+        log_test("LLM Circuit Breaker", False, f"Exception: {str(e)}")
+
+def test_chat_writer():
+    """Test chat turn write-behind: retries, poison messages, per-session flushes and the shutdown drain"""
+    print("\n🔍 Testing Chat Turn Writer")
+
+    from pymongo.errors import AutoReconnect, DocumentTooLarge
+
+    class FakeMessages:
+        """chat_messages stand-in with transient outages, oversized messages and stalls"""
+        def __init__(self, transient_failures=0):
+            self.docs = []
+            self.transient_failures = transient_failures
+            self.open = asyncio.Event()
+            self.open.set()
+
+        async def insert_many(self, docs, ordered=True):
+            await self.open.wait()
+            if self.transient_failures:
+                self.transient_failures -= 1
+                raise AutoReconnect("connection reset")
+            # Raised client-side before anything in the batch is sent
+            if any(doc["message"] == "oversized" for doc in docs):
+                raise DocumentTooLarge("BSON document too large")
+            self.docs.extend(docs)
+
+    try:
+        server = load_server()
+
+        def turn(session_id, question="Question"):
+            return [
+                server.ChatMessage(user_id="student-1", session_id=session_id, message=question, sender="user"),
+                server.ChatMessage(user_id="student-1", session_id=session_id, message="Answer", sender="ai")
+            ]
+
+        async def scenario(messages, max_retries, steps):
+            writer = server.ChatTurnWriter(max_pending=10, batch_size=10, retry_delay=0.01, max_retries=max_retries)
+            summarized = []
+
+            async def update_sessions(docs):
+                summarized.extend(docs)
+
+            writer.update_sessions = update_sessions
+            original_db = server.db
+            server.db = type("FakeDatabase", (), {"chat_messages": messages})()
+            try:
+                writer.start()
+                result = await steps(writer, messages)
+                await writer.close(timeout=1)
+            finally:
+                server.db = original_db
+            return result, writer, summarized
+
+        async def outage_and_stall(writer, messages):
+            await writer.add(turn("session-1"))
+            await writer.add(turn("session-2"))
+            pending = writer.has_pending("session-1")
+            flushed = await writer.flush_session("session-1", timeout=1)
+            written = sorted({doc["session_id"] for doc in messages.docs})
+            untouched = await writer.flush_session("session-unknown", timeout=0)
+
+            # A stalled database makes the reader give up instead of hanging
+            messages.open.clear()
+            await writer.add(turn("session-3"))
+            stalled = await writer.flush_session("session-3", timeout=0.05)
+            messages.open.set()
+            return pending, flushed, written, untouched, stalled
+
+        messages = FakeMessages(transient_failures=2)
+        (pending, flushed, written, untouched, stalled), writer, summarized = asyncio.run(
+            scenario(messages, 5, outage_and_stall)
+        )
+        log_test(
+            "Chat Writer Retries Transient Errors",
+            pending and flushed and written == ["session-1", "session-2"] and
+            writer.failures == 2 and writer.dropped == 0,
+            f"Written sessions: {written}, stats: {writer.stats()}"
+        )
+        log_test(
+            "Chat Writer Session Flush Timeout",
+            untouched and not stalled,
+            f"Unknown session flushed: {untouched}, stalled session flushed: {stalled}"
+        )
+        log_test(
+            "Chat Writer Drains On Shutdown",
+            len(messages.docs) == 6 and len(summarized) == 6 and
+            writer.stats()["queued_turns"] == 0 and not writer.has_pending("session-3"),
+            f"Stats: {writer.stats()}"
+        )
+
+        # An oversized message is dropped on its own; the rest of its batch is stored
+        async def poison_batch(writer, messages):
+            await writer.add(turn("session-4", question="oversized"))
+            await writer.add(turn("session-5"))
+            return await writer.flush_session("session-5", timeout=1)
+
+        messages = FakeMessages()
+        flushed, writer, summarized = asyncio.run(scenario(messages, 5, poison_batch))
+        log_test(
+            "Chat Writer Drops Poison Messages",
+            flushed and len(messages.docs) == 3 and writer.dropped == 1 and
+            all(doc["message"] != "oversized" for doc in messages.docs + summarized),
+            f"Stored: {[doc['message'] for doc in messages.docs]}, stats: {writer.stats()}"
+        )
+
+        # A database that stays down costs max_retries retries, then the batch is dropped
+        async def lasting_outage(writer, messages):
+            await writer.add(turn("session-6"))
+            return await writer.flush_session("session-6", timeout=1)
+
+        messages = FakeMessages(transient_failures=100)
+        flushed, writer, summarized = asyncio.run(scenario(messages, 2, lasting_outage))
+        log_test(
+            "Chat Writer Gives Up After Max Retries",
+            flushed and writer.failures == 3 and writer.dropped == 2 and not summarized,
+            f"Stats: {writer.stats()}"
+        )
+
+        # Tutor exchanges are folded into the context after the write, per session and in order;
+        # a failing context update neither blocks the writer nor loses the messages
+        folded = []
+
+        async def update_chat_context(session_id, user_id, turns):
+            if session_id == "session-8":
+                raise AutoReconnect("connection reset")
+            folded.append((session_id, [turn["user"] for turn in turns]))
+
+        async def exchanges(writer, messages):
+            await writer.add(turn("session-7", "First"), {"user": "First", "ai": "Answer"})
+            await writer.add(turn("session-8"), {"user": "Question", "ai": "Answer"})
+            await writer.add(turn("session-7", "Second"), {"user": "Second", "ai": "Answer"})
+            await writer.add(turn("session-7", "Fallback"))
+            return await writer.flush_session("session-7", timeout=1)
+
+        original_update = server.update_chat_context
+        server.update_chat_context = update_chat_context
+        try:
+            messages = FakeMessages()
+            messages.open.clear()
+            async def delayed(writer, messages):
+                # Hold the writer until every turn is queued, so they share one batch
+                task = asyncio.create_task(exchanges(writer, messages))
+                await asyncio.sleep(0.01)
+                messages.open.set()
+                return await task
+            flushed, writer, summarized = asyncio.run(scenario(messages, 5, delayed))
+        finally:
+            server.update_chat_context = original_update
+        log_test(
+            "Chat Writer Folds Tutor Context",
+            flushed and len(messages.docs) == 8 and folded == [("session-7", ["First", "Second"])],
+            f"Folded: {folded}, stored: {len(messages.docs)}"
+        )
+    except Exception as e:
+        log_test("Chat Turn Writer", False, f"Exception: {str(e)}")
+
 def print_summary():
     """Print test summary"""
     print("\n" + "=" * 80)
@@ -464,7 +2105,32 @@ def run_all_tests():
     
     # Additional features
     project_id = test_project_management(user_id)
+    test_section_tracking(user_id)
+    test_offline_sync(user_id, lesson_id, scenario_id)
+    test_gamification(user_id, scenario_id)
+    test_achievements(user_id)
+    test_research_exports(user_id)
     test_analytics(user_id)
+
+    # In-process server components
+    test_progress_buffer()
+    test_streak_rules()
+    test_points_and_active_days()
+    test_achievement_engine()
+    test_quiz_answer_keys()
+    test_section_bits()
+    test_export_streams()
+    test_cohort_rollups()
+    test_search_index()
+    test_lesson_passages()
+    test_chat_context()
+    test_chat_history_pages()
+    test_chat_stream()
+    test_fake_llm_backend()
+    test_answer_cache()
+    test_llm_limiter()
+    test_circuit_breaker()
+    test_chat_writer()
     
     # Print summary
     print_summary()
@@ -33,6 +33,10 @@ const LessonDetail = () => {
   const [completedSections, setCompletedSections] = useState([]);
   const [currentSection, setCurrentSection] = useState(0);
   const [loading, setLoading] = useState(true);
+  const [quiz, setQuiz] = useState([]);
+  const [quizAnswers, setQuizAnswers] = useState([]);
+  const [quizResult, setQuizResult] = useState(null);
+  const [submittingQuiz, setSubmittingQuiz] = useState(false);
 
   useEffect(() => {
     fetchLessonData();
@@ -41,7 +45,18 @@ const LessonDetail = () => {
   const fetchLessonData = async () => {
     try {
       const backendUrl = process.env.REACT_APP_BACKEND_URL || import.meta.env.REACT_APP_BACKEND_URL;
-      const response = await fetch(`${backendUrl}/api/lessons/${id}`);
+      // The lesson payload carries no answer keys; the quiz is graded by the backend
+      const [response, quizResponse] = await Promise.all([
+        fetch(`${backendUrl}/api/lessons/${id}`),
+        fetch(`${backendUrl}/api/lessons/${id}/quiz`)
+      ]);
+
+      if (quizResponse.ok) {
+        const quizData = await quizResponse.json();
+        setQuiz(quizData);
+        setQuizAnswers(quizData.map(() => null));
+        setQuizResult(null);
+      }
       
       if (response.ok) {
         const lessonData = await response.json();
@@ -120,6 +135,46 @@ const LessonDetail = () => {
     }, 1000);
   };
 
+  const handleQuizAnswer = (questionIndex, optionIndex) => {
+    if (quizResult) return;
+    setQuizAnswers(quizAnswers.map((answer, index) => (index === questionIndex ? optionIndex : answer)));
+  };
+
+  const handleSubmitQuiz = async () => {
+    setSubmittingQuiz(true);
+    try {
+      const backendUrl = process.env.REACT_APP_BACKEND_URL || import.meta.env.REACT_APP_BACKEND_URL;
+      const response = await fetch(`${backendUrl}/api/lessons/${id}/quiz/attempts`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          attempts: [{ user_id: "user-123", answers: quizAnswers }] // TODO: Get from user context
+        })
+      });
+      if (!response.ok) {
+        throw new Error(`Quiz grading failed: ${response.status}`);
+      }
+      const result = (await response.json()).results[0];
+      setQuizResult(result);
+      toast.success(`You scored ${result.score}/${result.total} (${result.percentage}%)`);
+    } catch (error) {
+      console.error("Failed to submit quiz:", error);
+      toast.error("Could not check your answers, please try again.");
+    } finally {
+      setSubmittingQuiz(false);
+    }
+  };
+
+  const quizOptionClass = (questionIndex, optionIndex) => {
+    if (quizAnswers[questionIndex] !== optionIndex) {
+      return "bg-white text-gray-700 hover:bg-gray-100";
+    }
+    if (!quizResult) {
+      return "bg-purple-100 text-purple-900";
+    }
+    return quizResult.correct[questionIndex] ? "bg-green-200 text-green-900" : "bg-red-100 text-red-900";
+  };
+
   const handleSectionClick = (sectionIndex) => {
     setCurrentSection(sectionIndex);
     if (!completedSections.includes(sectionIndex)) {
@@ -374,7 +429,7 @@ const LessonDetail = () => {
           )}
 
           {/* Quiz Section */}
-          {lesson.content?.quiz && (
+          {quiz.length > 0 && (
             <Card className="border-0 shadow-lg bg-white/80 backdrop-blur">
               <CardHeader>
                 <CardTitle className="flex items-center gap-2">
@@ -383,28 +438,41 @@ const LessonDetail = () => {
                 </CardTitle>
               </CardHeader>
               <CardContent className="space-y-4">
-                {lesson.content.quiz.map((question, index) => (
+                {quiz.map((question, index) => (
                   <div key={index} className="p-4 bg-green-50 rounded-lg border border-green-200">
                     <h4 className="font-semibold text-green-900 mb-3">{question.question}</h4>
                     <div className="space-y-2">
                       {question.options.map((option, optIndex) => (
                         <div 
                           key={optIndex} 
-                          className={`p-2 rounded cursor-pointer transition-colors ${
-                            optIndex === question.correct 
-                              ? "bg-green-200 text-green-900" 
-                              : "bg-white text-gray-700 hover:bg-gray-100"
-                          }`}
+                          onClick={() => handleQuizAnswer(index, optIndex)}
+                          className={`p-2 rounded cursor-pointer transition-colors ${quizOptionClass(index, optIndex)}`}
                         >
                           {option}
                         </div>
                       ))}
                     </div>
-                    <div className="mt-3 text-sm text-green-800">
-                      <strong>Explanation:</strong> {question.explanation}
-                    </div>
+                    {quizResult && (
+                      <div className="mt-3 text-sm text-green-800">
+                        <strong>{quizResult.correct[index] ? "Correct!" : "Not quite."}</strong>
+                      </div>
+                    )}
                   </div>
                 ))}
+                <div className="flex items-center justify-between">
+                  {quizResult && (
+                    <span className="text-sm font-semibold text-green-900">
+                      Score: {quizResult.score}/{quizResult.total} ({quizResult.percentage}%)
+                    </span>
+                  )}
+                  <Button
+                    className="ml-auto"
+                    onClick={quizResult ? () => { setQuizResult(null); setQuizAnswers(quiz.map(() => null)); } : handleSubmitQuiz}
+                    disabled={submittingQuiz || (!quizResult && quizAnswers.every(answer => answer === null))}
+                  >
+                    {quizResult ? "Try Again" : submittingQuiz ? "Checking..." : "Check Answers"}
+                  </Button>
+                </div>
               </CardContent>
             </Card>
           )}